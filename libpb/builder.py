@@ -19,6 +19,7 @@ class DependLoader(object):
         self.ports = {}
         self.method = {}
         self.finished = set()
+        self.retired = 0  #: Number of ports retired
 
     def __call__(self, port):
         """Try resolve a port as a dependency."""
@@ -27,11 +28,11 @@ class DependLoader(object):
         if port in self.ports:
             return self.ports[port]
         elif port in self.finished:
-            sig = signal.Signal()
+            sig = signal.Signal(oneshot=True)
             event.post_event(sig.emit, port)
             return sig
         else:
-            sig = signal.Signal()
+            sig = signal.Signal(oneshot=True)
             self.method[port] = env.flags["method"][0]
 
             for builder, method in zip((install, pkginstall, repoinstall),
@@ -52,7 +53,7 @@ class DependLoader(object):
     def register(self, stagejob):
         """Register a build job as a dependency."""
         assert stagejob.port not in self.ports
-        self.ports[stagejob.port] = signal.Signal()
+        self.ports[stagejob.port] = signal.Signal(oneshot=True)
         self.method[stagejob.port] = None
         stagejob.connect(self._clean)
 
@@ -65,6 +66,30 @@ class DependLoader(object):
 
         self.ports.pop(stagejob.port).emit(stagejob.port)
         self.finished.add(stagejob.port)
+        self.retire(stagejob.port)
+
+    def retire(self, port):
+        """Retire a resolved port, and its dependencies, once all their
+        dependants have finished (and no further stages are to be built)."""
+        from .port.dependhandler import Dependent
+
+        ports = [port]
+        if port.dependency is not None:
+            ports.extend(port.dependency.get())
+        for port in ports:
+            if (port in self.finished and "retired" not in port.flags and
+                    port.dependent.status == Dependent.RESOLV and
+                    not any(port in i.ports for i in builders.itervalues()) and
+                    all(self._finished(i) for i in port.dependent.get())):
+                port.retire()
+                self.retired += 1
+
+    def _finished(self, port):
+        """Indicate if a port will not be resolved (any further)."""
+        from .port.dependhandler import Dependent
+
+        return (port not in self.ports and
+                port.dependent.status != Dependent.UNRESOLV)
 
     def _find_method(self, port):
         """Find a method to resolve the port."""
@@ -162,10 +187,10 @@ class Builder(object):
         self.queue = queue
         self.stage = stage
         self.cleanup = set()
-        self.done = []
-        self.failed = []
+        self.done = 0  #: Number of ports done
+        self.failed = set()
         self.ports = {}
-        self.succeeded = []
+        self.succeeded = 0  #: Number of ports that succeeded
 
     @abc.abstractmethod
     def __call__(self, port):
@@ -215,7 +240,7 @@ class ConfigBuilder(Builder):
     def _cleanup(self, configjob):
         """Cleanup after the port was configured."""
         if configjob.stack.failed:
-            self.failed.append(configjob.port)
+            self.failed.add(configjob.port)
             self.update.emit(self, Builder.FAILED, configjob.port)
         else:
             self.update.emit(self, Builder.SUCCEEDED, configjob.port)
@@ -263,14 +288,11 @@ class DependBuilder(Builder):
     def _loaded(self, dependjob):
         """Port has finished loading dependency."""
         port = dependjob.port
-        if port.dependency is not None:
-            for q in queue.queues:
-                q.reorder()
         if dependjob.stack.failed:
-            self.failed.append(port)
+            self.failed.add(port)
             self.update.emit(self, Builder.FAILED, port)
         else:
-            self.succeeded.append(port)
+            self.succeeded += 1
             self.update.emit(self, Builder.SUCCEEDED, port)
         del self.ports[port]
 
@@ -367,15 +389,18 @@ class StageBuilder(Builder):
         if port in self.cleanup and not env.flags["mode"] == "clean":
             self.cleanup.remove(port)
             if not failed:
-                self.done.append(port)
+                self.done += 1
                 self.update.emit(self, Builder.DONE, port)
             if env.flags["target"][-1] == "clean":
                 queue.clean.add(job.CleanJob(port))
         elif not failed:
-            self.succeeded.append(port)
+            self.succeeded += 1
             self.update.emit(self, Builder.SUCCEEDED, port)
         if failed:
             self.update.emit(self, Builder.FAILED, port)
+        if port in depend_resolve.finished:
+            # The port may have been waiting on this stage to be retired
+            depend_resolve.retire(port)
 
     def _depend_resolv(self, port):
         """Update dependency structures for resolved dependency."""
@@ -409,7 +434,7 @@ class StageBuilder(Builder):
     def _port_failed(self, port):
         """Cleanup after a failed port."""
         if port not in self.failed:
-            self.failed.append(port)
+            self.failed.add(port)
             del self._pending[port]
             self.ports[port].done()
 
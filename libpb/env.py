@@ -6,7 +6,7 @@ import os
 
 __all__ = [
         "CPUS", "CONFIG", "DEPEND", "MODE", "PKG_MGMT", "STAGE", "TARGET",
-        "env", "master", "flags",
+        "TRACE", "env", "master", "flags",
     ]
 
 CPUS = os.sysconf("SC_NPROCESSORS_ONLN")
@@ -38,12 +38,14 @@ master = {
 #                       was last configured
 #               always  - always prompt
 #
-# debug - Collect and display extra debugging information about  when a slot
-#       was connected and when a signal was emitted.  Results in slower
-#       performance and higher memory usage.
+# debug - Log extra debugging messages.
 #
 # fetch_only - Only fetch a port's distfiles.
 #
+# history - The file where the time taken by each port's stages is saved,
+#       between runs.  The expected build time of a port is used to prioritise
+#       the ports on the longest chain of dependencies.
+#
 # log_dir - Directory where the log files, of the port build, and for
 #       portbuilder, are stored.
 #
@@ -74,6 +76,10 @@ master = {
 #               pkg     - The package tools shipped with FreeBSD base
 #               pkgng   - The next generation package tools shipped with ports
 #
+# snapshot - The file where the ports' attribute cache is saved between runs.
+#       Only ports whose Makefiles, options or make environment have changed
+#       need their attributes fetched.  If blank then no snapshot is used.
+#
 # target - The dependency targets when building a port required by a dependant.
 #       The currently supported targets are:
 #               install   - install the port
@@ -81,18 +87,29 @@ master = {
 #               clean     - clean the port, may be specified before and/or
 #                       after the install/package target indicating that the
 #                       port should cleaned before or after, respectively.
+#
+# trace - The debugging information collected about when a slot was connected
+#       and when a signal was emitted.  The currently supported modes are:
+#               none     - do not collect any information
+#               recorder - record the emitting frame of recent events (with a
+#                       full traceback sampled periodically)
+#               full     - collect full tracebacks for every connection and
+#                       emission.  Results in slower performance and higher
+#                       memory usage.
 CONFIG   = ("none", "changed", "newer", "all")
 METHOD   = ("build", "package", "repo")
 MODE     = ("install", "recursive", "clean")
 PKG_MGMT = ("pkg", "pkgng")
 STAGE    = (0, 1, 2, 3)
 TARGET   = ("clean", "install", "package")
+TRACE    = ("none", "recorder", "full")
 flags = {
   "buildstatus" : 0,                    # The minimum level for build
   "chroot"      : "",                   # Chroot directory of system
   "config"      : "changed",            # Configure ports based on criteria
   "debug"       : True,                 # Print extra debug messages
   "fetch_only"  : False,                # Only fetch ports
+  "history"     : "/var/db/portbuilder/history",  # Stage durations
   "log_dir"     : "/tmp/portbuilder",   # Directory for logging information
   "log_file"    : "portbuilder",        # General log file
   "method"      : ["build"],            # Resolve dependencies methods
@@ -100,5 +117,7 @@ flags = {
   "no_op"       : False,                # Do nothing
   "no_op_print" : False,                # Print commands instead of execution
   "pkg_mgmt"    : "pkg",                # The package system used ('pkg(ng)?')
-  "target"      : ["install", "clean"]  # Dependency target (aka DEPENDS_TARGET)
+  "snapshot"    : "/var/db/portbuilder/snapshot",  # Port attributes
+  "target"      : ["install", "clean"], # Dependency target (aka DEPENDS_TARGET)
+  "trace"       : "recorder",           # Collect tracebacks of events
 }
@@ -3,23 +3,17 @@
 Provides a framework for calling functions asynchronously."""
 from __future__ import absolute_import
 
-import errno
 import collections
-import select
+import functools
 import time
 
-from libpb import log, queue
+from libpb import log, poll, queue
 
 from .signal import InlineSignal, SignalProperty
 
-__all__ = ["alarm", "event", "pending_events", "post_event", "resume", "run",
-           "start", "stop", "suspend", "traceback"]
-
-try:
-    select.kevent(0, 0, 0, select.KQ_NOTE_EXIT, 0, 0)
-    ISSUE11973 = False
-except OverflowError:
-    ISSUE11973 = True
+__all__ = ["alarm", "event", "instrument", "pending_events", "post_event",
+           "resume", "run", "slot_report", "slot_stats", "start", "stats",
+           "stop", "suspend", "traceback"]
 
 
 class EventManager(object):
@@ -28,20 +22,33 @@ class EventManager(object):
     start = SignalProperty("start", signal=InlineSignal)
     stop  = SignalProperty("stop",  signal=InlineSignal)
 
-    def __init__(self):
+    def __init__(self, backend=None):
         """Initialise the event manager.
 
         A sleeper function is used to wake up once a new event comes
-        available."""
+        available.  The backend (see libpb.poll) defaults to the best one
+        supported by the system."""
+        if backend is None:
+            backend = poll.Backend
         self._events = collections.deque()
         self._alarms = 0
         self._alarm_active = True
-        self._kq = select.kqueue()
-        self._kq_events = {}
+        self._backend = backend()
+        self._sys_events = {}
         self.traceback = ()
         self.event_count = 0
         self._no_tb = False
 
+        self.batch = 16        #: Minimum number of kernel events per poll
+        self.timeslice = 0.05  #: Time spent on posted events before polling
+        self.stats = {
+                "syscalls": 0,       # Number of polls of the kernel
+                "kernel_events": 0,  # Number of events returned by the kernel
+                "max_pending": 0,    # Maximum number of outstanding events
+            }
+        self.instrument = False  #: Record the time spent in each slot
+        self.slot_stats = {}  #: [calls, total, max, total delay, max delay]
+
     def __len__(self):
         """The number of outstanding events."""
         return len(self._events)
@@ -52,7 +59,7 @@ class EventManager(object):
         return self._alarms
 
     def event(self, obj, mode="r", clear=False, data=0):
-        """Add or remove a kevent monitor.
+        """Add or remove a kernel event monitor.
 
         Current events are:
           r - Read a file descriptor
@@ -64,55 +71,48 @@ class EventManager(object):
             - - Informs when subprocess dies
           s - Signal handling
         """
-        note = 0
-        if mode == "r":
-            event = (obj.fileno(), select.KQ_FILTER_READ)
-        elif mode == "w":
-            event = (obj.fileno(), select.KQ_FILTER_WRITE)
-        elif mode == "t":
-            event = (obj, select.KQ_FILTER_TIMER)
-            data = int(data * 1000)
+        if mode in ("r", "w"):
+            ident = obj.fileno()
+        elif mode in ("t", "s"):
+            ident = obj
         elif mode.startswith("p"):
-            event = (obj.pid, select.KQ_FILTER_PROC)
-            if "f" in mode[1:]:
-                note |= select.KQ_NOTE_FORK
-            elif "e" in mode[1:]:
-                note |= select.KQ_NOTE_EXEC
-            elif "-" in mode[1:]:
-                if ISSUE11973:
-                    # HACK: work around python bug!!!
-                    note -= select.KQ_NOTE_EXIT
-                else:
-                    note |= select.KQ_NOTE_EXIT
-        elif mode == "s":
-            event = (obj, select.KQ_FILTER_SIGNAL)
+            ident = obj.pid
         else:
             raise ValueError("unknown event mode")
+        event = (ident, mode[0])
 
         if clear:
             try:
-                self._kq_events.pop(event)
-                self._kq.control((select.kevent(event[0], event[1],
-                                                select.KQ_EV_DELETE),), 0)
+                self._sys_events.pop(event)
             except KeyError:
                 raise KeyError("no event registered")
+            self._backend.unregister(ident, mode[0])
         else:
-            if event not in self._kq_events:
+            if event not in self._sys_events:
                 from .signal import Signal
-                kevent = select.kevent(event[0], event[1],
-                                       select.KQ_EV_ADD | select.KQ_EV_ENABLE,
-                                       note, data)
-                self._kq.control((kevent,), 0)
-                self._kq_events[event] = Signal()
-            return self._kq_events[event]
+                self._backend.register(obj, ident, mode, data)
+                self._sys_events[event] = Signal()
+            return self._sys_events[event]
 
     def post_event(self, func, *args, **kwargs):
-        """Add an event to be called asynchronously."""
+        """Add an event to be called asynchronously.
+
+        A signal posts (slot, args, kwargs, tb, time), where slot may be a
+        tuple of slots to be called in order."""
+        now = time.time()
         if not callable(func):
             assert(len(func) == 5)
-            self._events.append(func + (log.get_tb(1), time.time()))
+            tb = log.get_tb(1)
+            self._events.append(func + (tb, now))
+            if tb is not None:
+                slot = func[0]
+                log.record(tb, slot[0] if slot.__class__ is tuple else slot,
+                           now)
         else:
-            self._events.append((func, args, kwargs, None, 0, log.get_tb(), time.time()))
+            tb = log.get_tb()
+            self._events.append((func, args, kwargs, None, 0, tb, now))
+            if tb is not None:
+                log.record(tb, func, now)
 
     def run(self):
         """Run the currently queued events."""
@@ -122,17 +122,27 @@ class EventManager(object):
         try:
             self.start.emit()
             while True:
-                events = 0
+                timeslice = time.time() + self.timeslice
                 while len(self._events):
-                    events += 1
-                    if events == 50:
+                    if len(self._events) > self.stats["max_pending"]:
+                        self.stats["max_pending"] = len(self._events)
+                    if time.time() > timeslice:
+                        # Give kernel events (i.e. finished jobs) a turn
                         self._queue(0)
-                        events = 0
+                        timeslice = time.time() + self.timeslice
                     self.event_count += 1
                     func, args, kwargs, tb_slot, tbs_time, tb_call, tbc_time = self._events.popleft()
                     self._construct_tb((tb_slot, "signal connection <%.4f>" % (tbs_time - log.start_time)),
                                        (tb_call, "signal emitter <%.4f>" % (tbc_time - log.start_time)))
-                    func(*args, **kwargs)
+                    # A signal posts all its slots as a single event
+                    for func in (func if func.__class__ is tuple else (func,)):
+                        if self.instrument:
+                            start = time.time()
+                            func(*args, **kwargs)
+                            self._record(func, start - tbc_time,
+                                         time.time() - start)
+                        else:
+                            func(*args, **kwargs)
                     self._clear_tb()
 
                 for q in queues:
@@ -146,6 +156,40 @@ class EventManager(object):
 
         finally:
             self.stop.emit()
+            stats = self.stats
+            log.debug("EventManager.run()",
+                      "%i events, %i syscalls, %.2f kernel events per poll, "
+                      "%i maximum pending events" %
+                          (self.event_count, stats["syscalls"],
+                           float(stats["kernel_events"]) /
+                               max(1, stats["syscalls"]),
+                           stats["max_pending"]))
+
+    def slot_report(self):
+        """Report the time spent in each slot (sorted by total time)."""
+        report = ["%-56s %7s %9s %8s %8s %8s" % ("slot", "calls", "total",
+                                                 "max", "delay", "max")]
+        stats = sorted(self.slot_stats.items(), key=lambda x: -x[1][1])
+        for name, (calls, total, maximum, delay, max_delay) in stats:
+            report.append("%-56s %7i %9.3f %8.4f %8.4f %8.4f" %
+                          (name[-56:], calls, total, maximum,
+                           delay / calls, max_delay))
+        return "\n".join(report) + "\n"
+
+    def _record(self, func, delay, duration):
+        """Record the time spent in, and waiting for, a slot."""
+        name = slot_name(func)
+        stats = self.slot_stats.get(name)
+        if stats is None:
+            self.slot_stats[name] = [1, duration, duration, delay, delay]
+        else:
+            stats[0] += 1
+            stats[1] += duration
+            stats[3] += delay
+            if duration > stats[2]:
+                stats[2] = duration
+            if delay > stats[4]:
+                stats[4] = delay
 
     def _construct_tb(self, *args):
         """Add extra tracebacks for debugging purposes."""
@@ -165,24 +209,31 @@ class EventManager(object):
             self.traceback = None
 
     def _queue(self, timeout=None):
-        """Run any events returned by kqueue."""
-        while True:
-            # Retry self._kq_control if the system call was interrupted
-            try:
-                events = self._kq.control(None, 16, timeout)
-                break
-            except OSError, e:
-                if e.errno == errno.EINTR:
-                    continue
-                raise
-        for ev in events:
-            event = (ev.ident, ev.filter)
-            if event in self._kq_events:
-                if (ev.filter == select.KQ_FILTER_PROC and
-                    ev.fflags == select.KQ_NOTE_EXIT):
-                    self._kq_events.pop(event).emit()
+        """Run any events returned by the kernel."""
+        # Allow all registered events to be returned in a single poll
+        batch = max(self.batch, len(self._sys_events))
+        events = self._backend.control(batch, timeout)
+        self.stats["syscalls"] += 1
+        self.stats["kernel_events"] += len(events)
+        for event, finished in events:
+            if event in self._sys_events:
+                if finished:
+                    self._sys_events.pop(event).emit()
                 else:
-                    self._kq_events[event].emit()
+                    self._sys_events[event].emit()
+
+
+def slot_name(func):
+    """The qualified name of a slot."""
+    if isinstance(func, functools.partial):
+        return "partial(%s)" % slot_name(func.func)
+    im_class = getattr(func, "im_class", None)
+    if im_class is not None:
+        return "%s.%s.%s" % (im_class.__module__, im_class.__name__,
+                             func.__name__)
+    if hasattr(func, "__name__"):
+        return "%s.%s" % (getattr(func, "__module__", None), func.__name__)
+    return "%s.%s()" % (func.__class__.__module__, func.__class__.__name__)
 
 
 _manager = EventManager()
@@ -190,11 +241,15 @@ _manager = EventManager()
 alarm          = _manager.alarm
 event          = _manager.event
 event_count    = lambda: _manager.event_count
+instrument     = lambda: setattr(_manager, "instrument", True)
 pending_events = _manager.__len__
 post_event     = _manager.post_event
 resume         = _manager.start.emit
 run            = _manager.run
+slot_report    = _manager.slot_report
+slot_stats     = lambda: _manager.slot_stats
 start          = _manager.start
+stats          = lambda: _manager.stats
 stop           = _manager.stop
 suspend        = _manager.stop.emit
 traceback      = lambda: (_manager.traceback if _manager.traceback else ())
@@ -0,0 +1,92 @@
+"""Historical durations of port stages.
+
+The time taken by each port's stages is recorded and saved between runs.  A
+port's expected build time is used as its weight when prioritising ports (see
+libpb.port.priority)."""
+
+from __future__ import absolute_import
+
+import os
+
+from libpb import env, log
+
+__all__ = ["History", "db"]
+
+
+class History(object):
+    """A database of the time taken by each port's stages."""
+
+    #: Stages whose duration is recorded
+    STAGES = ("Checksum", "Fetch", "Build", "Install", "Package")
+
+    def __init__(self):
+        """Initialise an empty database."""
+        self._durations = {}  #: Durations of each stage, per origin
+        self._default = None  #: Estimate for ports without a history
+
+    def __len__(self):
+        return len(self._durations)
+
+    def load(self):
+        """Load the durations recorded by previous runs."""
+        self._durations = {}
+        try:
+            with open(env.flags["history"], "r") as history:
+                for line in history:
+                    line = line.split()
+                    if len(line) != 3 or line[1] not in History.STAGES:
+                        continue
+                    try:
+                        duration = float(line[2])
+                    except ValueError:
+                        continue
+                    origin, stage = line[0], line[1]
+                    self._durations.setdefault(origin, {})[stage] = duration
+        except IOError:
+            pass
+        totals = sorted(sum(i.values()) for i in self._durations.values())
+        if totals:
+            self._default = int(totals[len(totals) // 2])
+        else:
+            self._default = None
+
+    def save(self):
+        """Save the recorded durations."""
+        path = env.flags["history"]
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path + ".new", "w") as history:
+                for origin, durations in sorted(self._durations.items()):
+                    for stage, duration in sorted(durations.items()):
+                        history.write("%s %s %.1f\n" %
+                                      (origin, stage, duration))
+            os.rename(path + ".new", path)
+        except (IOError, OSError), e:
+            log.error("History.save()",
+                      "Unable to save stage durations: %s" % e)
+
+    def record(self, origin, stage, duration):
+        """Record the time taken to complete a stage.
+
+        The duration is averaged with the previously recorded duration, to
+        smooth out variations between runs."""
+        if stage not in History.STAGES:
+            return
+        durations = self._durations.setdefault(origin, {})
+        if stage in durations:
+            duration = (durations[stage] + duration) / 2
+        durations[stage] = duration
+
+    def estimate(self, origin):
+        """The expected time taken to build a port.
+
+        Ports without a history are expected to take the median time of all
+        recorded ports.  If there is no history at all then None is
+        returned."""
+        if origin in self._durations:
+            return int(sum(self._durations[origin].values()))
+        return self._default
+
+
+db = History()
@@ -0,0 +1,275 @@
+"""The ports INDEX.
+
+Provides the package name and dependencies of every port, as recorded in the
+ports INDEX file, without needing to query the ports with make.  The INDEX is
+read in a single pass and stored compactly: each package is identified by a
+number and the dependencies of a port are stored as an array of numbers.
+
+The INDEX may also be generated (see IndexBuilder), with the ports' attributes
+fetched concurrently through the attribute queue."""
+
+from __future__ import absolute_import
+
+import array
+import os
+import tempfile
+
+from libpb import env, log, mk, pkg, queue
+
+__all__ = ["Index", "IndexBuilder", "db", "index_file"]
+
+# The fields of an INDEX line
+PKGNAME  = 0
+PATH     = 1
+EXTRACT  = 7
+PATCH    = 8
+FETCH    = 9
+BUILD    = 10
+RUN      = 11
+WWW      = 12
+FIELDS   = 13
+
+
+def index_file():
+    """The name of the INDEX file for the system's version."""
+    osversion = os.environ.get("OSVERSION", "")
+    if osversion.isdigit():
+        name = "INDEX-%i" % (int(osversion) // 100000)
+    else:
+        name = "INDEX"
+    return os.path.join(env.flags["chroot"] + env.env["PORTSDIR"], name)
+
+
+class Index(object):
+    """The package names and dependencies of the ports."""
+
+    def __init__(self):
+        """Initialise an empty index."""
+        self._ids = {}       #: Map of package names to their id
+        self._pkgnames = []  #: The package name of each id
+        self._origins = []   #: The origin of each id (None if unknown)
+        self._depends = []   #: The dependencies (as ids) of each id
+        self.origins = {}    #: Map of origins to their id
+
+    def __contains__(self, origin):
+        return origin in self.origins
+
+    def __len__(self):
+        return len(self.origins)
+
+    def load(self, path=None):
+        """Load the INDEX file (by default the one for the system)."""
+        if path is None:
+            path = index_file()
+        self._ids = {}
+        self._pkgnames = []
+        self._origins = []
+        self._depends = []
+        self.origins = {}
+        with open(path, "r") as index:
+            for line in index:
+                line = line.split("|")
+                if len(line) != FIELDS:
+                    continue
+                pkgid = self._id(line[PKGNAME])
+                # The origin is the last two components of the port's path
+                # (PORTSDIR may differ from where the INDEX was generated)
+                origin = "/".join(line[PATH].rsplit("/", 2)[-2:])
+                self._origins[pkgid] = origin
+                self.origins[origin] = pkgid
+                depends = set()
+                for i in (EXTRACT, PATCH, FETCH, BUILD, RUN):
+                    depends.update(line[i].split())
+                self._depends[pkgid] = array.array("i", sorted(
+                                            self._id(i) for i in depends))
+
+    def pkgname(self, origin):
+        """The package name of a port."""
+        return self._pkgnames[self.origins[origin]]
+
+    def depends(self, origin):
+        """The origins of a port's dependencies (of all types)."""
+        return [self._origins[i] for i in self._depends[self.origins[origin]]
+                if self._origins[i] is not None]
+
+    def status(self, origin):
+        """Query the install status of a port, as per PKGDB.status()."""
+        return pkg.db.status_pkgname(origin, self.pkgname(origin))
+
+    def _id(self, pkgname):
+        """The id of a package name (allocating one if needed)."""
+        pkgid = self._ids.get(pkgname)
+        if pkgid is None:
+            pkgid = self._ids[pkgname] = len(self._pkgnames)
+            self._pkgnames.append(pkgname)
+            self._origins.append(None)
+            self._depends.append(None)
+        return pkgid
+
+
+class IndexBuilder(object):
+    """Generate the ports INDEX.
+
+    The attributes of the ports are fetched concurrently (in batches, see
+    mk.attr()), in order of origin, with at most window ports outstanding.
+    The results are reordered and each port is recorded (in a temporary
+    file) once all the ports before it have been recorded, so only the
+    window of ports is held in memory.  Once all ports are recorded the INDEX
+    is written, with each type of dependency expanded to include the run
+    dependencies of the dependencies (as per `make index')."""
+
+    def __init__(self, path=None, window=None):
+        """Initialise the INDEX builder, writing to path (by default the
+        INDEX file for the system)."""
+        self.path = path if path is not None else index_file()
+        self.window = window  #: Maximum number of ports outstanding
+        self.failed = []      #: Ports whose attributes could not be fetched
+        self._origins = []    #: The ports, in order
+        self._next = 0        #: The next port to fetch
+        self._recorded = 0    #: The number of ports recorded
+        self._results = {}    #: Fetched ports waiting to be recorded
+        self._records = None  #: Temporary file with the recorded ports
+        self._ids = {}        #: Map of origins to their id
+        self._pkgnames = []   #: The package name of each id (None if unknown)
+        self._run = []        #: The run dependencies (as ids) of each id
+
+    def start(self):
+        """Start generating the INDEX."""
+        if self.window is None:
+            self.window = 2 * mk.BATCH * max(1, queue.attr.load)
+        self._origins = self._scan()
+        self._records = tempfile.TemporaryFile()
+        log.debug("IndexBuilder.start()", "Generating INDEX for %i ports" %
+                      len(self._origins))
+        if self._origins:
+            self._fill()
+        else:
+            self._write()
+
+    def _scan(self):
+        """The origins of all ports in the ports tree, in order."""
+        portsdir = env.flags["chroot"] + env.env["PORTSDIR"]
+        origins = []
+        for category in sorted(os.listdir(portsdir)):
+            # Categories are lower case (unlike Mk, Tools, etc)
+            path = os.path.join(portsdir, category)
+            if (not category[0].islower() or
+                    not os.path.isfile(os.path.join(path, "Makefile"))):
+                continue
+            for port in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, port, "Makefile")):
+                    origins.append("%s/%s" % (category, port))
+        return origins
+
+    def _fill(self):
+        """Fetch the attributes of the next ports, up to the window."""
+        while (self._next < len(self._origins) and
+               self._next - self._recorded < self.window):
+            # The attributes are not kept in the snapshot, so only the window
+            # of ports is held in memory
+            mk.attr(self._origins[self._next], False).connect(self._loaded)
+            self._next += 1
+
+    def _loaded(self, origin, attr):
+        """Record the fetched ports, in order."""
+        self._results[origin] = attr
+        while (self._recorded < len(self._origins) and
+               self._origins[self._recorded] in self._results):
+            origin = self._origins[self._recorded]
+            self._record(origin, self._results.pop(origin))
+            self._recorded += 1
+        if self._recorded == len(self._origins):
+            self._write()
+        elif self._next - self._recorded <= self.window // 2:
+            # Refill in bulk, so the ports are fetched in batches
+            self._fill()
+
+    def _record(self, origin, attr):
+        """Record a port's INDEX line, with dependencies as origins."""
+        if attr is None:
+            self.failed.append(origin)
+            return
+        pkgid = self._id(origin)
+        self._pkgnames[pkgid] = attr["pkgname"]
+        depends = {}
+        for i in ("extract", "patch", "fetch", "build", "run", "lib"):
+            # Dependencies may specify a target (i.e. origin:target)
+            depends[i] = " ".join(sorted(set(
+                    port.split(":", 1)[0] for _, port in
+                    attr["depend_" + i])))
+        depends["build"] = " ".join((depends["build"], depends["lib"]))
+        depends["run"] = " ".join((depends["run"], depends["lib"]))
+        self._run[pkgid] = array.array("i", sorted(set(
+                self._id(i) for i in depends["run"].split())))
+        self._records.write("|".join((
+                origin, attr["prefix"], attr["comment"], attr["descr"],
+                attr["maintainer"], " ".join(attr["category"]),
+                depends["extract"], depends["patch"], depends["fetch"],
+                depends["build"], depends["run"], self._www(attr["descr"]))))
+        self._records.write("\n")
+
+    def _write(self):
+        """Write the INDEX, from the recorded ports."""
+        portsdir = env.env["PORTSDIR"]
+        self._records.seek(0)
+        try:
+            with open(self.path + ".new", "w") as index:
+                for line in self._records:
+                    line = line.rstrip("\n").split("|")
+                    pkgid = self._ids[line[0]]
+                    fields = [self._pkgnames[pkgid],
+                              os.path.join(portsdir, line[0])]
+                    fields.extend(line[1:6])
+                    for depends in line[6:11]:
+                        fields.append(" ".join(self._expand(
+                            self._id(i) for i in depends.split())))
+                    fields.append(line[11])
+                    index.write("|".join(fields) + "\n")
+            os.rename(self.path + ".new", self.path)
+        except (IOError, OSError), e:
+            log.error("IndexBuilder._write()",
+                      "Unable to write INDEX: %s" % e)
+        else:
+            log.debug("IndexBuilder._write()",
+                      "Wrote INDEX for %i ports (%i failed)" %
+                          (len(self._origins) - len(self.failed),
+                           len(self.failed)))
+        self._records.close()
+
+    def _expand(self, depends):
+        """The package names of the dependencies, and their (recursive) run
+        dependencies."""
+        seen = set()
+        stack = list(depends)
+        while stack:
+            pkgid = stack.pop()
+            if pkgid not in seen:
+                seen.add(pkgid)
+                if self._run[pkgid] is not None:
+                    stack.extend(self._run[pkgid])
+        return sorted(self._pkgnames[i] for i in seen
+                      if self._pkgnames[i] is not None)
+
+    def _id(self, origin):
+        """The id of an origin (allocating one if needed)."""
+        pkgid = self._ids.get(origin)
+        if pkgid is None:
+            pkgid = self._ids[origin] = len(self._pkgnames)
+            self._pkgnames.append(None)
+            self._run.append(None)
+        return pkgid
+
+    @staticmethod
+    def _www(descr):
+        """The port's web site, as given in its description file."""
+        try:
+            with open(env.flags["chroot"] + descr, "r") as pkg_descr:
+                for line in pkg_descr:
+                    if line.startswith("WWW:"):
+                        return line[4:].strip()
+        except IOError:
+            pass
+        return ""
+
+
+db = Index()
@@ -10,8 +10,14 @@ __all__ = ["Job", "PortJob", "StalledJob"]
 
 
 class StalledJob(RuntimeError):
-    """Exception indicating the job cannot run right now."""
-    pass
+    """Exception indicating the job cannot run right now.
+
+    If a wakeup signal is given then the job is only retried after the signal
+    has been emitted, otherwise it is retried whenever another job finishes."""
+
+    def __init__(self, wakeup=None):
+        RuntimeError.__init__(self)
+        self.wakeup = wakeup
 
 
 class Job(Signal):
@@ -26,7 +32,7 @@ class Job(Signal):
 
         Higher the value of priority, the greater the precedent.  Load
         indicates how many resources is required to run the job (i.e. CPUs)."""
-        Signal.__init__(self)
+        Signal.__init__(self, oneshot=True)
         if priority is not None:
             self.priority = priority
         self.load = load
@@ -36,6 +42,18 @@ class Job(Signal):
     def __lt__(self, other):
         return self.priority > other.priority
 
+    def coalesce(self, _jobs):  # pylint: disable-msg=R0201
+        """Select the queued jobs to run together with this job.
+
+        The selected jobs are run when this job is run, sharing its load."""
+        return ()
+
+    def fit(self, load):
+        """Reduce the job's load to fit the available load, if possible.
+
+        Called before a job is run with more load than is available."""
+        pass
+
     @abstractmethod
     def work(self):
         """Do the hard work.
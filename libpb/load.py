@@ -0,0 +1,148 @@
+"""Load control.
+
+Periodically samples the system's load average and memory pressure and
+adjusts the loads of the queues (within bounds) to keep the system busy
+without swapping."""
+
+from __future__ import absolute_import
+
+import os
+import subprocess
+
+from libpb import env, event, log, make, queue
+
+__all__ = ["LoadControl", "controller", "enable"]
+
+controller = None  #: The active load controller (if any)
+
+#: The memory counters sampled on FreeBSD (free, inactive, total, swap in/out)
+SYSCTL = ("sysctl", "-n", "vm.stats.vm.v_free_count",
+          "vm.stats.vm.v_inactive_count", "vm.stats.vm.v_page_count",
+          "vm.stats.vm.v_swappgsin", "vm.stats.vm.v_swappgsout")
+
+
+class LoadControl(object):
+    """Adjust queue loads based on the system's load."""
+
+    def __init__(self, bounds=None):
+        """Initialise the load controller.
+
+        Bounds map a queue to its (minimum, maximum) load, by default the
+        queue's load may vary between 1 and its current load."""
+        self.delay = 5  #: Delay between samples
+        self.target = env.CPUS  #: The target system load
+        self.loadavg = 0.0  #: The last sampled load average
+        self.pressure = False  #: Indicates if the system is swapping
+        if bounds is None:
+            bounds = dict((i, (1, i.load))
+                          for i in (queue.attr, queue.checksum, queue.build))
+        self.bounds = bounds
+        self._swap = None  #: Pages swapped at last sample
+        self._sysctl = None  #: The sysctl(8) sampling the memory (if any)
+
+        self._timer_id = event.alarm()
+        event.event(self._timer_id, "t", data=self.delay).connect(self.sample)
+
+    def sample(self):
+        """Sample the system's load and adjust the queues."""
+        if env.flags["mode"] == "clean":
+            # Queues have been stopped
+            return
+        self.loadavg = os.getloadavg()[0]
+        if self._psi_pressure():
+            self._adjust(True)
+        elif os.path.isfile("/proc/meminfo"):
+            self._adjust(self._pressure(*self._meminfo()))
+        elif self._sysctl is None:
+            # Sample the memory counters without blocking the event loop
+            try:
+                self._sysctl = make.Popen(SYSCTL, "sysctl", None,
+                                          subprocess.PIPE, subprocess.STDOUT)
+            except OSError:
+                self._adjust(False)
+            else:
+                self._sysctl.connect(self._post_sysctl)
+
+    def _adjust(self, pressure):
+        """Adjust the queues' loads given the memory pressure."""
+        if env.flags["mode"] == "clean":
+            # Queues have been stopped
+            return
+        self.pressure = pressure
+        for q, (minimum, maximum) in self.bounds.items():
+            if self.pressure:
+                # Back off quickly when swapping
+                load = max(minimum, min(q.load, q.active_load) // 2)
+            elif self.loadavg > self.target * 1.5:
+                load = max(minimum, q.load - 1)
+            elif self.loadavg < self.target:
+                load = min(maximum, q.load + 1)
+            else:
+                continue
+            if load != q.load:
+                log.debug("LoadControl._adjust()",
+                          "Load %.2f%s: adjusting queue load %i -> %i" %
+                              (self.loadavg, " (swapping)" if self.pressure
+                                                           else "",
+                               q.load, load))
+                q.load = load
+
+    def _post_sysctl(self, sysctl):
+        """Process the memory counters from sysctl(8)."""
+        self._sysctl = None
+        output = sysctl.stdout.read().split()
+        sysctl.stdout.close()
+        if sysctl.wait() != make.SUCCESS or len(output) != len(SYSCTL) - 2:
+            self._adjust(self._pressure(None, None))
+            return
+        output = [int(i) for i in output]
+        self._adjust(self._pressure(float(output[0] + output[1]) / output[2],
+                                    output[3] + output[4]))
+
+    def _pressure(self, free, swap):
+        """Indicate if the system is under memory pressure, given the
+        fraction of free memory and pages swapped (in and out)."""
+        pressure = (swap is not None and self._swap is not None and
+                    swap > self._swap)
+        self._swap = swap
+        return pressure or (free is not None and free < 0.05)
+
+    @staticmethod
+    def _psi_pressure():
+        """Indicate if Linux's pressure stall information reports memory
+        pressure."""
+        try:
+            with open("/proc/pressure/memory", "r") as pressure:
+                for line in pressure:
+                    if line.startswith("full"):
+                        if float(line.split()[1].split("=")[1]) > 1.0:
+                            return True
+        except (IOError, OSError, IndexError, ValueError):
+            pass
+        return False
+
+    @staticmethod
+    def _meminfo():
+        """The fraction of free memory and pages swapped (in and out), from
+        Linux's /proc."""
+        meminfo = {}
+        with open("/proc/meminfo", "r") as mem:
+            for line in mem:
+                line = line.split()
+                meminfo[line[0][:-1]] = int(line[1])
+        swapped = 0
+        with open("/proc/vmstat", "r") as vmstat:
+            for line in vmstat:
+                line = line.split()
+                if line[0] in ("pswpin", "pswpout"):
+                    swapped += int(line[1])
+        free = meminfo.get("MemAvailable", meminfo["MemFree"])
+        return float(free) / meminfo["MemTotal"], swapped
+
+
+def enable(bounds=None):
+    """Enable load control."""
+    global controller
+    if controller is None:
+        controller = LoadControl(bounds)
+    return controller
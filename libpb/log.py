@@ -2,6 +2,8 @@
 
 from __future__ import absolute_import, with_statement
 
+import collections
+import itertools
 import os
 import sys
 import time
@@ -9,19 +11,54 @@ import traceback
 
 from libpb import env
 
-__all__ = ["debug", "error", "exception", "get_tb"]
+__all__ = ["debug", "error", "exception", "get_tb", "record"]
 
 start_time = time.time()
 
+recent = collections.deque(maxlen=64)  #: Flight recorder of recent events
+sample_rate = 1000  #: Capture a full traceback every sample_rate calls
+_samples = itertools.count()
+
 
 def get_tb(offset=0):
-    """Get the current traceback, excluding the top `offset` frames."""
-    if env.flags["debug"]:
+    """Get the current traceback, excluding the top `offset` frames.
+
+    With the "recorder" trace mode only the calling frame is captured (with a
+    full traceback sampled every sample_rate calls)."""
+    trace = env.flags["trace"]
+    if trace == "recorder" and _samples.next() % sample_rate:
+        try:
+            frame = sys._getframe(offset + 2)  # pylint: disable-msg=W0212
+        except ValueError:
+            return None
+        code = frame.f_code
+        return [(code.co_filename, frame.f_lineno, code.co_name, None)]
+    elif trace != "none":
         return traceback.extract_stack()[:-(offset + 2)]
     else:
         return None
 
 
+def record(tb, slot, now):
+    """Record an event in the flight recorder."""
+    recent.append((tb, slot, now))
+
+
+def format_recent():
+    """Format the flight recorder into descriptive human format."""
+    if not recent:
+        return ""
+    from libpb.event import slot_name
+
+    msg = "Recent events (most recent last):\n"
+    for tb, slot, now in recent:
+        msg += "  [%11.4f] %s" % (now - start_time, slot_name(slot))
+        if tb:
+            msg += " <- %s:%i (%s)" % tb[-1][:3]
+        msg += "\n"
+    return msg
+
+
 def format_tb(tb, name):
     """Format traceback (if present) into descriptive human format."""
     if tb is None:
@@ -59,11 +96,12 @@ def error(func, msg, trace=False):
     """Report an error to the general logfile"""
     msg = msg.replace("\n", "n  ")
     fullmsg = "[%11.4f] (E) %s> %s\n" % (offset_time(), func, msg)
-    if trace and env.flags["debug"]:
+    if trace and env.flags["trace"] != "none":
         from libpb import event
         msg = "  "
         msg += "".join(format_tb(tb, name) for tb, name in event.traceback())
-        msg += format_tb(get_tb(), "message")
+        msg += format_tb(traceback.extract_stack()[:-1], "message")
+        msg += format_recent()
         fullmsg += msg.replace("\n", "\n  ")[:-2]
 
     with open(logfile(), "a") as log:
@@ -81,5 +119,5 @@ def exception():
     msg += "\n"
     with open(logfile(), "a") as log:
         log.write("[%10.3f] (EXCEPTION)\n  " % (offset_time()))
-        log.write(msg.replace("\n", "\n  ")[:-2])
+        log.write((format_recent() + msg).replace("\n", "\n  ")[:-2])
     return msg
@@ -10,7 +10,7 @@ from libpb import env
 
 from .signal import Signal
 
-__all__ = ["SUCCESS", "make_target"]
+__all__ = ["SUCCESS", "make_args", "make_target"]
 
 SUCCESS = 0
 
@@ -41,14 +41,8 @@ def env2args(environ):
             yield "%s=%s" % (key, value)
 
 
-def make_target(port, targets, pipe=None, **kwargs):
-    """Build a make target and call a function when finished."""
-    if isinstance(port, str):
-        assert pipe is True
-        origin = port
-    else:
-        origin = port.origin
-
+def make_args(origin, targets, **kwargs):
+    """The arguments to invoke make with for a port's targets."""
     if isinstance(targets, str):
         targets = (targets,)
     elif not isinstance(targets, tuple):
@@ -63,7 +57,18 @@ def make_target(port, targets, pipe=None, **kwargs):
         # Remove default environment variables
         if environ[key] == value:
             del environ[key]
-    args += tuple(env2args(environ))
+    return args + tuple(env2args(environ))
+
+
+def make_target(port, targets, pipe=None, **kwargs):
+    """Build a make target and call a function when finished."""
+    if isinstance(port, str):
+        assert pipe is True
+        origin = port
+    else:
+        origin = port.origin
+
+    args = make_args(origin, targets, **kwargs)
 
     if env.flags["chroot"]:
         args = ("chroot", env.flags["chroot"]) + args
@@ -100,7 +105,7 @@ class Popen(subprocess.Popen, Signal):
         subprocess.Popen.__init__(self, target, stdin=stdin, stdout=stdout,
                                   stderr=stderr, close_fds=True,
                                   preexec_fn=os.setsid)
-        Signal.__init__(self, "Popen")
+        Signal.__init__(self, "Popen", oneshot=True)
         self.origin = origin
 
         event(self, "p-").connect(self._emit)
@@ -123,7 +128,7 @@ class PopenNone(Signal):
     def __init__(self, args, origin):
         from .event import post_event
 
-        Signal.__init__(self)
+        Signal.__init__(self, "PopenNone", oneshot=True)
         self.origin = origin
         if env.flags["no_op_print"]:
             print subprocess.list2cmdline(args)
@@ -2,13 +2,22 @@
 
 from __future__ import absolute_import
 
+import cStringIO
+import errno
+import fcntl
 import os
+import pipes
 import re
 import subprocess
 
-from libpb import env, job, log, make, queue, signal
+from libpb import env, event, job, log, make, queue, signal, snapshot
 
-__all__ = ["Attr", "attr", "cache", "clean", "load_defaults"]
+__all__ = ["Attr", "AttrBatch", "PortAttr", "attr", "cache", "clean",
+           "load_defaults"]
+
+BATCH = 16  #: Maximum number of ports whose attributes are fetched per shell
+
+_pending = []  #: Ports waiting for their attributes to be fetched
 
 
 def bootstrap_master():
@@ -135,45 +144,79 @@ def cache():
         os.environ["_OSVERSION"] = uname[2]
 
 
-def attr(origin):
-    """Retrieve a ports attributes by using the attribute queue."""
+def attr(origin, record=True):
+    """Retrieve a ports attributes by using the attribute queue.
+
+    The attributes are recorded in the snapshot unless record is False."""
     # TODO inline function to caller
-    log.debug("attr()", "Port '%s': getting attribute" % origin)
-    attr_obj = Attr(origin)
-    queue.attr.add(job.AttrJob(attr_obj))
+    attr_obj = Attr(origin, record)
+    if not attr_obj.cached():
+        log.debug("attr()", "Port '%s': getting attribute" % origin)
+        if not _pending:
+            event.post_event(_queue_pending)
+        _pending.append(attr_obj)
     return attr_obj
 
 
+def _queue_pending():
+    """Queue the ports waiting for their attributes, in batches."""
+    # Batch the ports, while still using all of the attr queue's load
+    size = min(BATCH, max(1, -(-len(_pending) // queue.attr.load)))
+    while _pending:
+        attrs = _pending[:size]
+        del _pending[:size]
+        if len(attrs) == 1:
+            queue.attr.add(job.AttrJob(attrs[0]))
+        else:
+            queue.attr.add(job.AttrJob(AttrBatch(attrs)))
+
+
+def _attr_args():
+    """The make arguments to get the attributes of a port."""
+    args = []
+    # Pass all the arguments from ports_attr table
+    for i in ports_attr.itervalues():
+        args.append('-V')
+        args.append(i[0])
+    return args
+
+
 class Attr(signal.Signal):
     """Get the attributes for a given port"""
 
-    def __init__(self, origin):
-        super(Attr, self).__init__()
+    def __init__(self, origin, record=True):
+        super(Attr, self).__init__(oneshot=True)
         self.origin = origin
+        self.record = record  #: Record the attributes in the snapshot
+
+    def cached(self):
+        """Get the attributes from the cache, if available (and current)."""
+        attr_map = snapshot.db.get(self.origin)
+        if attr_map is None:
+            return False
+        event.post_event(self.emit, self.origin, attr_map)
+        return True
 
     def get(self):
         """Get the attributes from the port by invoking make"""
-        args = []  #: Arguments to be passed to the make target
-        # Pass all the arguments from ports_attr table
-        for i in ports_attr.itervalues():
-            args.append('-V')
-            args.append(i[0])
-
-        pmake = make.make_target(self.origin, args, True)
+        pmake = make.make_target(self.origin, _attr_args(), True)
         return pmake.connect(self.parse_attr)
 
     def parse_attr(self, pmake):
         """Parse the attributes from a port and call the requested function."""
-        # TODO: if pmake.wait() != make.SUCCESS
-        if pmake.wait() != 0:
+        self.parse(pmake.wait(), pmake.stdout, pmake.stderr)
+
+    def parse(self, status, stdout, stderr):
+        """Parse the output of make and call the requested function."""
+        # TODO: if status != make.SUCCESS
+        if status != 0:
             log.error("Attr.parse_attr()",
                       "Failed to get port %s attributes (err=%s)\n%s" %
-                          (self.origin, pmake.returncode,
-                           "".join(pmake.stderr.readlines())))
+                          (self.origin, status, "".join(stderr.readlines())))
             self.emit(self.origin, None)
             return
 
-        errs = pmake.stderr.readlines()
+        errs = stderr.readlines()
         if len(errs):
             log.error("Attr.parse_attr()",
                       "Non-fatal errors in port %s attributes\n%s" %
@@ -183,10 +226,10 @@ class Attr(signal.Signal):
         for name, value in ports_attr.iteritems():
             if value[1] is str:
                 # Get the string (stripped)
-                attr_map[name] = pmake.stdout.readline().strip()
+                attr_map[name] = stdout.readline().strip()
             else:
                 # Pass the string through a special processor (like list/tuple)
-                attr_map[name] = value[1](pmake.stdout.readline().split())
+                attr_map[name] = value[1](stdout.readline().split())
             # Apply all filters for the attribute
             for i in value[2:]:
                 try:
@@ -202,9 +245,102 @@ class Attr(signal.Signal):
         for fltr in ports_fltr:
             fltr(attr_map)
 
+        if self.record:
+            snapshot.db.record(self.origin, attr_map)
         self.emit(self.origin, attr_map)
 
 
+class AttrBatch(object):
+    """Get the attributes for several ports, from a single shell.
+
+    Only the shell is spawned by portbuilder: it still invokes make once per
+    port, in turn.  The shell frames the output of each make (stdout then
+    stderr) as "\\001<status> <origin>\\n<stdout>\\001<stderr>\\002".  The
+    output is read as it arrives, and the attributes of each port are passed
+    on once the port's make has finished (rather than once all have)."""
+
+    def __init__(self, attrs):
+        self.attrs = attrs
+        self.origin = ", ".join(i.origin for i in attrs)
+        self._buffer = ""  #: Output of make not yet parsed
+        self._stdout = None  #: The output of the shell (until closed)
+        self._waiting = list(attrs)  #: Ports not yet parsed
+
+    def get(self):
+        """Get the attributes from the ports by invoking make."""
+        script = ['tmp=$(mktemp "${TMPDIR:-/tmp}/portbuilder.XXXXXXXX")',
+                  '[ -n "$tmp" ] || exit 1']
+        for attr in self.attrs:
+            args = make.make_args(attr.origin, _attr_args())
+            script.append("%s >\"$tmp\" 2>\"$tmp.err\"" %
+                          " ".join(pipes.quote(i) for i in args))
+            script.append("printf '\\001%%d %%s\\n' $? %s" %
+                          pipes.quote(attr.origin))
+            script.append('cat "$tmp"; printf \'\\001\'; cat "$tmp.err"; '
+                          'printf \'\\002\'')
+        script.append('rm -f "$tmp" "$tmp.err"')
+        args = ("sh", "-c", "\n".join(script))
+        if env.flags["chroot"]:
+            args = ("chroot", env.flags["chroot"]) + args
+
+        pmake = make.Popen(args, self.origin, subprocess.PIPE, subprocess.PIPE,
+                           subprocess.PIPE)
+        pmake.stdin.close()
+        self._stdout = pmake.stdout
+        flags = fcntl.fcntl(self._stdout, fcntl.F_GETFL)
+        fcntl.fcntl(self._stdout, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        event.event(self._stdout).connect(self._read)
+        return pmake.connect(self.parse_attr)
+
+    def parse_attr(self, pmake):
+        """Parse the attributes of the remaining ports."""
+        if self._stdout is not None:
+            self._read()
+        if self._stdout is not None:
+            # NB: the shell has exited, its output is complete
+            self._close()
+        errs = pmake.stderr.read()
+        for attr in self._waiting:
+            # The shell failed before invoking make for the port
+            attr.parse(pmake.returncode or 1, cStringIO.StringIO(),
+                       cStringIO.StringIO(errs))
+        self._waiting = []
+
+    def _close(self):
+        """Stop reading the output of the shell."""
+        event.event(self._stdout, clear=True)
+        self._stdout.close()
+        self._stdout = None
+
+    def _read(self):
+        """Read the output of the shell, and parse the finished ports."""
+        if self._stdout is None:
+            return
+        output = []
+        try:
+            while True:
+                data = os.read(self._stdout.fileno(), 65536)
+                if not data:
+                    self._close()
+                    break
+                output.append(data)
+        except OSError, e:
+            if e.errno not in (errno.EAGAIN, errno.EINTR):
+                raise
+        sections = (self._buffer + "".join(output)).split("\002")
+        self._buffer = sections.pop()
+        for section in sections:
+            header, stderr = section[1:].split("\001", 1)
+            header, stdout = header.split("\n", 1)
+            status, origin = header.split(" ", 1)
+            for attr in self._waiting:
+                if attr.origin == origin:
+                    self._waiting.remove(attr)
+                    attr.parse(int(status), cStringIO.StringIO(stdout),
+                               cStringIO.StringIO(stderr))
+                    break
+
+
 def _sysctl(name):
     """Retrieve the string value of a sysctlbyname(3)."""
     # TODO: create ctypes wrapper around sysctl(3)
@@ -339,3 +475,54 @@ def ports_options(attr):
     attr["options"] = options
     del attr["_options"]
 ports_fltr.append(ports_options)
+
+
+def _intern(value):
+    """Intern the strings in an attribute (including those in containers)."""
+    if isinstance(value, str):
+        return intern(value)
+    elif isinstance(value, (tuple, list)):
+        return value.__class__(_intern(i) for i in value)
+    elif isinstance(value, dict):
+        return dict((intern(i), intern(j)) for i, j in value.iteritems())
+    return value
+
+
+def ports_intern(attr):
+    """Intern the attributes' strings, which are mostly shared by ports."""
+    for name, value in attr.iteritems():
+        attr[name] = _intern(value)
+ports_fltr.append(ports_intern)
+
+
+class PortAttr(object):
+    """The attributes of a port used once the port has been loaded.
+
+    Only the attributes used by a port are kept (the other attributes of
+    ports_attr are only needed to load or index a port), and the attributes
+    used to plan the port's dependencies may be released once planned.  The
+    attributes are accessed as per a dictionary."""
+
+    __slots__ = ("pkgname", "pkgfile", "jobs_number", "options", "optionsfile",
+                 "distfiles", "distdir", "distinfo", "no_package", "wrkdir",
+                 "depend_build", "depend_extract", "depend_fetch", "depend_lib",
+                 "depend_run", "depend_patch", "depend_package")
+
+    def __init__(self, attr):
+        """Initialise the port's attributes from all of its attributes."""
+        for name in PortAttr.__slots__:
+            setattr(self, name, attr[name])
+
+    def __contains__(self, name):
+        return name in PortAttr.__slots__
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def release(self, *names):
+        """Release attributes that are no longer needed."""
+        for name in names:
+            setattr(self, name, ())
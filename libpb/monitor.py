@@ -8,7 +8,7 @@ import curses, curses.ascii
 import sys
 import time
 
-from libpb import env, event, queue, stacks
+from libpb import env, event, load, queue, snapshot, stacks
 
 from .port.port import Port
 from .builder import Builder
@@ -205,6 +205,7 @@ class Top(Monitor):
         """Update the header details."""
         self._offset = 0
         self._update_ports(scr)
+        self._update_load(scr)
         self._update_summary(scr, stages)
         for stage in stages:
             self._update_stage(scr, stage)
@@ -237,10 +238,29 @@ class Top(Monitor):
                                                     len(queue.attr))
             else:
                 msg += "; retrieving %i" % len(queue.attr)
+        if snapshot.db.hits or snapshot.db.misses:
+            msg += "; cached %i (of %i)" % (snapshot.db.hits, snapshot.db.hits +
+                                            snapshot.db.misses)
         scr.addstr(self._offset, 0, msg)
 
         self._offset += 1
 
+    def _update_load(self, scr):
+        """Update the load control details."""
+        control = load.controller
+        if control is None:
+            return
+
+        queues = (("build", queue.build), ("checksum", queue.checksum),
+                  ("attr", queue.attr))
+        msg = "Load: %.2f (target %i)%s; %s" % (
+                control.loadavg, control.target,
+                " swapping" if control.pressure else "",
+                ", ".join("%s %i/%i" % (name, q.active_load, q.load)
+                          for name, q in queues))
+        scr.addstr(self._offset, 0, msg)
+        self._offset += 1
+
     def _update_summary(self, scr, stages):
         """Update the summary information."""
         msg = dict((i, 0) for i in STATUS.values())
@@ -339,8 +359,8 @@ class Top(Monitor):
 
             # Display ports cleaning and queued to be cleaned
             if self._idle:
-                clean = (queue.clean.active + queue.clean.stalled +
-                         queue.clean.queue)
+                clean = (queue.clean.active + list(queue.clean.stalled) +
+                         list(queue.clean.queue))
             else:
                 clean = queue.clean.active
             if self._skip >= len(clean):
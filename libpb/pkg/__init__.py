@@ -4,9 +4,13 @@ tools.
 """
 from __future__ import absolute_import
 
+import hashlib
+import os
+import shutil
 import subprocess
+import tempfile
 
-from libpb import env, make
+from libpb import env, event, log, make, signal
 from . import pkg, pkgng
 
 # Installed status flags
@@ -15,25 +19,92 @@ OLDER   = 1
 CURRENT = 2
 NEWER   = 3
 
-__all__ = ["add", "change", "db", "query", "remove", "version"]
+__all__ = ["PackageBatch", "PackageCmd", "add", "change", "cmp_version", "db",
+           "fetch", "fetched", "query", "remove", "version", "version_key"]
+
+BATCH = 16  #: Maximum number of package commands run together
+FETCH = 4   #: Maximum number of packages fetched at the same time (per job)
 
 mgmt = {
         "pkg":   pkg,
         "pkgng": pkgng,
     }
 
+_pending = []  #: Commands waiting to modify the package database
+_active = []   #: The command modifying the package database (if any)
+
 def add(port, repo=False, pkg_dir=None):
-    """Add a package for port."""
+    """Add a package for port.
+
+    Packages added by jobs run together (see PackageCmd.batch) are added
+    using a single command, if the package manager supports it (see
+    PackageBatch)."""
     args = mgmt[env.flags["pkg_mgmt"]].add(port, repo, pkg_dir)
-    return cmd(port, args)
+    return _queue(port, args)
 
 
 def change(port, prop, value):
     """Change a property of a package,"""
     args = mgmt[env.flags["pkg_mgmt"]].change(port, prop, value)
+    return _queue(port, args)
+
+
+def fetch(port):
+    """Fetch the repository package for port into the package cache."""
+    args = mgmt[env.flags["pkg_mgmt"]].fetch(port)
     return cmd(port, args)
 
 
+def fetched(port):
+    """Indicate if the repository package for port is in the package cache.
+
+    If the repository recorded the package's checksum then the cached package
+    must match it, for example (with a package cache in a temporary
+    directory):
+
+    >>> class Port(object):
+    ...     origin = "category/port"
+    ...     attr = {"pkgname": "port-1.0"}
+    >>> env.env["PKG_CACHEDIR"] = tempfile.mkdtemp()
+    >>> repo_db._add(Port.origin, "port-1.0")
+    >>> repo_db.files = {"port-1.0": ("All/port-1.0.txz",
+    ...                               hashlib.sha256("package").hexdigest())}
+    >>> path = os.path.join(env.env["PKG_CACHEDIR"], "All")
+    >>> os.mkdir(path)
+    >>> path = os.path.join(path, "port-1.0.txz")
+    >>> fetched(Port)
+    False
+    >>> open(path, "wb").write("package")
+    >>> fetched(Port)
+    True
+    >>> open(path, "wb").write("corrupt")
+    >>> fetched(Port)
+    False
+    >>> shutil.rmtree(env.env["PKG_CACHEDIR"])
+    """
+    package = repo_db.package(port)
+    if package is None:
+        suffix = mgmt[env.flags["pkg_mgmt"]].suffix
+        path = os.path.join("All", port.attr["pkgname"] + suffix)
+        checksum = None
+    else:
+        path, checksum = package
+    path = os.path.join(env.flags["chroot"] + env.env["PKG_CACHEDIR"], path)
+    if not os.path.isfile(path):
+        return False
+    if not checksum or len(checksum) != 64:
+        # Only plain SHA256 digests are verified
+        return True
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as pkgfile:
+            for block in iter(lambda: pkgfile.read(65536), ""):
+                digest.update(block)
+    except IOError:
+        return False
+    return digest.hexdigest() == checksum.lower()
+
+
 def info(repo=False):
     """List all installed packages with their respective port origin."""
     args = mgmt[env.flags["pkg_mgmt"]].info(repo)
@@ -69,7 +140,7 @@ def remove(port):
     """Remove a package for a port."""
     pkgs = tuple(db.get(port))
     args = mgmt[env.flags["pkg_mgmt"]].remove(pkgs)
-    return cmd(port, args)
+    return _queue(port, args)
 
 
 def cmd(port, args, do_op=False):
@@ -88,89 +159,365 @@ def cmd(port, args, do_op=False):
     return pkg_cmd
 
 
-def version(old, new):
-    """Compare two package names and indicates the difference."""
-    old = old.rsplit('-', 1)[1]  # Name and version components of the old pkg
-    new = new.rsplit('-', 1)[1]  # Name and version components of the new pkg
+def _queue(port, args):
+    """Queue a command that modifies the package database.
+
+    The package database is modified by one command at a time, as the package
+    tools do not support concurrent changes."""
+    if not args:
+        return args
+    pkg_cmd = PackageCmd(port, args)
+    if not _pending and not _active:
+        event.post_event(_run_pending)
+    _pending.append(pkg_cmd)
+    return pkg_cmd
+
 
-    if old == new:
-        # The packages are the same
-        return CURRENT
+def _run_pending():
+    """Run the next command waiting to modify the package database.
+
+    Commands of the same batch, run the same way (e.g. adding a package from
+    the same repository) and differing only in the package, are run together
+    if the command accepts several packages."""
+    if _active or not _pending:
+        return
+    batch = _pending[0].batch
+    prefix = _pending[0].args[:-1]
+    if batch is None or prefix not in mgmt[env.flags["pkg_mgmt"]].batch:
+        pkg_cmds = _pending[:1]
+    else:
+        pkg_cmds = [i for i in _pending
+                    if i.batch is batch and i.args[:-1] == prefix]
+    for pkg_cmd in pkg_cmds:
+        _pending.remove(pkg_cmd)
+    if len(pkg_cmds) > 1:
+        _active.append(PackageBatch(pkg_cmds))
+    else:
+        _active.append(pkg_cmds[0])
+    _active[0].run()
+
+
+def _finished(pkg_cmd):
+    """A command has finished modifying the package database."""
+    _active.remove(pkg_cmd)
+    _run_pending()
+
+
+class PackageCmd(signal.Signal):
+    """A command modifying the package database for a port, as a Popen-like
+    signal."""
+
+    def __init__(self, port, args):
+        """Initialise the command."""
+        super(PackageCmd, self).__init__("PackageCmd", oneshot=True)
+        self.args = args
+        self.batch = None  #: The commands' batch (commands run together)
+        self.job = None  #: The job waiting on the command (given its pid)
+        self.pid = None
+        self.port = port
+        self.returncode = None
+
+    def run(self):
+        """Run the command, by itself."""
+        self.started(cmd(self.port, self.args).connect(self._done).pid)
+
+    def started(self, pid):
+        """Indicate the process running the command (if any)."""
+        self.pid = pid
+        if self.job is not None:
+            self.job.pid = pid
+
+    def finish(self, returncode):
+        """Indicate the command has finished."""
+        self.started(None)
+        self.returncode = returncode
+        self.emit(self)
+
+    def wait(self):
+        """The exit status of the command."""
+        return self.returncode
+
+    def _done(self, pkg_cmd):
+        """The process running the command has finished."""
+        self.finish(pkg_cmd.wait())
+        _finished(self)
+
+
+class PackageBatch(object):
+    """Run the commands for several ports, as a single command.
+
+    If the command fails then each command is run by itself, in turn."""
+
+    def __init__(self, pkg_cmds):
+        """Initialise the command for the ports."""
+        self.pkg_cmds = pkg_cmds
+        self.args = pkg_cmds[0].args[:-1] + tuple(i.args[-1] for i in pkg_cmds)
+        self.pid = None
+        self._output = None  #: Temporary file with the command's output
+
+    def run(self):
+        """Run the command."""
+        args = self.args
+        if env.flags["chroot"]:
+            args = ("chroot", env.flags["chroot"]) + args
+        origin = ", ".join(i.port.origin for i in self.pkg_cmds)
+        if env.flags["no_op"]:
+            pkg_cmd = make.PopenNone(args, origin)
+        else:
+            self._output = tempfile.TemporaryFile()
+            self._output.write("# %s\n" % " ".join(args))
+            self._output.flush()
+            pkg_cmd = make.Popen(args, origin, subprocess.PIPE, self._output,
+                                 self._output)
+            pkg_cmd.stdin.close()
+        self.pid = pkg_cmd.connect(self._done).pid
+        for i in self.pkg_cmds:
+            i.started(self.pid)
+
+    def _done(self, pkg_cmd):
+        """Pass the result on to each port, or run the commands singly."""
+        self.pid = None
+        if self._output is not None:
+            # Record the command's output in each port's log file
+            for i in self.pkg_cmds:
+                self._output.seek(0)
+                with open(i.port.log_file, "a") as logfile:
+                    shutil.copyfileobj(self._output, logfile)
+            self._output.close()
+        if pkg_cmd.wait() == make.SUCCESS:
+            for i in self.pkg_cmds:
+                i.finish(make.SUCCESS)
+        else:
+            log.debug("PackageBatch._done()",
+                      "Failed to run command together, running singly: %s" %
+                          ", ".join(i.port.origin for i in self.pkg_cmds))
+            for i in self.pkg_cmds:
+                i.started(None)
+                i.batch = None
+            _pending[0:0] = self.pkg_cmds
+        _finished(self)
 
-    # Check the ports apoch
-    old, new, pstatus = cmp_attr(old, new, ',')
-    if pstatus:
-        return CURRENT + pstatus
+
+def version(old, new):
+    """Compare two package names and indicates the difference."""
+    return CURRENT + cmp_version(_parse(old)[1], _parse(new)[1])
+
+
+def cmp_version(old, new):
+    """Compare two parsed versions (see version_key()), as per cmp().
+
+    The versions are ordered as per pkg_version(1), for example:
+
+    >>> pairs = (("1.0a", "1.0"), ("1.0a", "1.0.a"), ("1.0.pl1", "1.0"),
+    ...          ("1.0.pl1", "1.0alpha1"), ("1.0alpha1", "1.0beta1"),
+    ...          ("1.0beta1", "1.0pre1"), ("1.0pre1", "1.0rc1"),
+    ...          ("1.0rc1", "1.0"), ("1.0", "1.0.0"), ("1.0", "1.0.1"),
+    ...          ("1.0_1", "1.0"), ("1.0", "1.0_0"), ("1,1", "2"),
+    ...          ("1.0,1", "1.0_1,1"), ("*", "0"), ("1.*", "1.a"),
+    ...          ("1.0", "1.0+1"), ("1.10", "1.9"), ("1.0b", "1.0a2"))
+    >>> [cmp_version(version_key("p-" + old), version_key("p-" + new))
+    ...  for old, new in pairs]
+    [-1, 0, -1, -1, -1, -1, -1, -1, 0, -1, 1, 0, 1, -1, -1, -1, -1, 1, 1]
+    """
+    # Check the ports epoch
+    if old[0] != new[0]:
+        return cmp(old[0], new[0])
+
+    # Check the ports version from left to right, with missing components
+    # treated as zero (and each part, separated by "+", compared separately)
+    for i in range(max(len(old[1]), len(new[1]))):
+        old_part = old[1][i] if i < len(old[1]) else ()
+        new_part = new[1][i] if i < len(new[1]) else ()
+        for j in range(max(len(old_part), len(new_part))):
+            pstatus = cmp(old_part[j] if j < len(old_part) else _ZERO,
+                          new_part[j] if j < len(new_part) else _ZERO)
+            if pstatus:
+                return pstatus
 
     # Check the ports revision
-    old, new, pstatus = cmp_attr(old, new, '_')
-    if old == new and pstatus:
-        return CURRENT + pstatus
-
-    # Check the ports version from left to right
-    old = old.split('.')
-    new = new.split('.')
-    for i in range(min(len(old), len(new))):
-        # Try numerical comparison, otherwise use str
-        try:
-            pstatus = cmp(int(old[i]), int(new[i]))
-        except ValueError:
-            pstatus = cmp(old[i], new[i])
-        # If there is a difference in this version level
-        if pstatus:
-            return CURRENT + pstatus
-
-    # The difference between the number of version levels
-    return CURRENT - cmp(len(old), len(new))
-
-
-def cmp_attr(old, new, sym):
-    """Compare the two attributes of the port."""
-    old = old.rsplit(sym, 1)  # The value of the old pkg
-    new = new.rsplit(sym, 1)  # The value of the new pkg
-    if len(old) > len(new):  # If old has version and new does not
-        pstatus = 1
-    elif len(old) < len(new): # If new has version and old does not
-        pstatus = -1
-    elif len(old) == len(new) == 1:  # If neither has version
-        pstatus = 0
-    else: #if len(old) == 2 and len(new) == 2 # Both have version
-        pstatus = cmp(int(old[1]), int(new[1]))
-    return (old[0], new[0], pstatus)
+    return cmp(old[2], new[2])
+
+
+def version_key(pkgname):
+    """The parsed version of a package name: (epoch, parts, revision).
+
+    As per pkg_version(1), the version is split into parts (separated by
+    "+"), and each part into components (separated by "." and other
+    punctuation, or where a letter follows a number).  A component is a tuple
+    of (number, letter, patch level), where components starting with a letter
+    (including the special strings "alpha", "beta", "pre", "rc" and "pl") sort
+    before any number, and "*" before everything else."""
+    return _parse(pkgname)[1]
+
+
+VERSION_CACHE = 65536  #: Maximum number of parsed package names cached
+
+_versions = {}  #: Cache of parsed package names: (name, version key)
+
+#: The special strings of a version, and their letter value
+_STAGES = (("pl", 0), ("alpha", 1), ("beta", 2), ("pre", 16), ("rc", 18))
+
+_ZERO = (0, 0, 0)  #: A missing version component
+
+
+def _parse(pkgname):
+    """Parse a package name into its name and version key (cached)."""
+    parsed = _versions.get(pkgname)
+    if parsed is None:
+        if len(_versions) >= VERSION_CACHE:
+            _versions.clear()
+        name = pkgname.rsplit("-", 1)
+        pkgversion = name[-1]
+        epoch = revision = 0
+        end = len(pkgversion)
+        sep = pkgversion.rfind("_")
+        if sep != -1:
+            revision = _number(pkgversion, sep + 1)[0]
+            end = sep
+        sep = pkgversion.rfind(",")
+        if sep != -1:
+            epoch = _number(pkgversion, sep + 1)[0]
+            end = min(end, sep)
+        parsed = (name[0], (epoch, _parts(pkgversion[:end]), revision))
+        _versions[pkgname] = parsed
+    return parsed
+
+
+def _number(string, pos):
+    """The number at the position in a string (or 0 if none), and the
+    position after the number."""
+    end = pos
+    while end < len(string) and string[end].isdigit():
+        end += 1
+    return (int(string[pos:end]) if end > pos else 0), end
+
+
+def _parts(pkgversion):
+    """Split a version into parts, and the parts into components."""
+    parts = []
+    components = []
+    pos = 0
+    while pos < len(pkgversion):
+        if pkgversion[pos] == "+":
+            parts.append(tuple(components))
+            components = []
+            pos += 1
+        else:
+            pos, component = _component(pkgversion, pos)
+            components.append(component)
+    parts.append(tuple(components))
+    return tuple(parts)
+
+
+def _component(pkgversion, pos):
+    """Parse a version component: [number][letter[patch level]]."""
+    end = len(pkgversion)
+    number = letter = patch = 0
+    stage = False
+    if pkgversion[pos].isdigit():
+        number, pos = _number(pkgversion, pos)
+    elif pkgversion[pos] == "*":
+        number = -2
+        pos += 1
+        while pos < end and pkgversion[pos] != "+":
+            pos += 1
+    else:
+        number = -1
+        stage = True
+
+    # A letter after a number starts the next component (i.e. "1.0a" is
+    # "1.0.a")
+    if stage and pos < end and pkgversion[pos].isalpha():
+        for name, value in _STAGES:
+            after = pos + len(name)
+            if (pkgversion[pos:after].lower() == name and
+                    not (after < end and pkgversion[after].isalpha())):
+                letter = value
+                pos = after
+                break
+        else:
+            # Use the first letter and skip the following
+            letter = ord(pkgversion[pos].lower()) - ord("a") + 1
+            while pos < end and pkgversion[pos].isalpha():
+                pos += 1
+        if pos < end and pkgversion[pos].isdigit():
+            patch, pos = _number(pkgversion, pos)
+        else:
+            patch = -1
+
+    # Skip the trailing separators
+    while (pos < end and not pkgversion[pos].isalnum() and
+           pkgversion[pos] not in "+*"):
+        pos += 1
+    return pos, (number, letter, patch)
 
 
 class PKGDB(object):
-    """A package database that tracks the installed packages."""
+    """A package database that tracks the installed packages.
+
+    The packages are indexed by origin (ports) and by package name
+    (origins), and for each origin by the name of the package without its
+    version (so a port's packages are found without scanning all the packages
+    of an origin)."""
 
     def __init__(self, repo=False):
         super(PKGDB, self).__init__()
-        self.ports = {}
+        self.files = None  #: The path and checksum of each package (if loaded)
+        self.options = None  #: The options of each package (if loaded)
+        self.origins = {}  #: The origin of each package
+        self.ports = {}  #: The packages of each origin
         self.repo = repo
+        self._names = {}  #: The packages of each origin, per package name
 
     def __contains__(self, port):
-        return (port.origin in self.ports and
-                port.attr["pkgname"] in self.ports[port.origin])
+        return self.origins.get(port.attr["pkgname"]) == port.origin
 
     def add(self, port):
         """Indicate that a port has been installed."""
-        if port.origin in self.ports:
-            self.ports[port.origin].add(port.attr["pkgname"])
-        else:
-            self.ports[port.origin] = set([port.attr["pkgname"]])
+        self._add(port.origin, port.attr["pkgname"])
+
+    def config(self, port):
+        """The options of a port's package, or None if not known."""
+        if self.options is None or port not in self:
+            return None
+        return self.options.get(port.attr["pkgname"], {})
 
     def load(self):
-        """(Re)load the package database."""
-        self.ports = info(self.repo)
+        """(Re)load the package database.
+
+        The package database is read directly, if supported by the package
+        manager, otherwise the package manager is queried."""
+        pkgdb = mgmt[env.flags["pkg_mgmt"]].load(self.repo)
+        if pkgdb:
+            pkgdb, self.options, self.files = pkgdb
+        else:
+            pkgdb = info(self.repo)
+            self.files = self.options = None
+        self.origins = {}
+        self.ports = {}
+        self._names = {}
+        for origin, pkgnames in pkgdb.iteritems():
+            for pkgname in pkgnames:
+                self._add(origin, pkgname)
+
+    def package(self, port):
+        """The path (relative to the package cache) and checksum of a port's
+        package, or None if not known."""
+        if self.files is None or port not in self:
+            return None
+        return self.files.get(port.attr["pkgname"])
 
     def remove(self, port):
         """Indicate that a port has been uninstalled."""
-        if port.origin in self.ports:
-            portname = port.attr["pkgname"].rsplit('-', 1)[0]
-            pkgs = set()
-            for pkgname in self.ports[port.origin]:
-                if pkgname.rsplit('-', 1)[0] == portname:
-                    pkgs.add(pkgname)
-            self.ports[port.origin] -= pkgs
+        names = self._names.get(port.origin)
+        if names is not None:
+            pkgs = names.pop(_parse(port.attr["pkgname"])[0], ())
+            for pkgname in pkgs:
+                del self.origins[pkgname]
+            self.ports[port.origin].difference_update(pkgs)
+            if not names:
+                del self._names[port.origin]
+                del self.ports[port.origin]
 
     def get(self, port):
         """Get a list of packages installed for a port."""
@@ -181,15 +528,47 @@ class PKGDB(object):
 
     def status(self, port):
         """Query the install status of a port."""
-        pstatus = ABSENT
-        if port.origin in self.ports:
-            pstatus = OLDER
-            portname = port.attr["pkgname"].rsplit('-', 1)[0]
-            for pkgname in self.ports[port.origin]:
-                if pkgname.rsplit('-', 1)[0] == portname:
-                    pstatus = max(pstatus,
-                                  version(pkgname, port.attr["pkgname"]))
+        return self.status_pkgname(port.origin, port.attr["pkgname"])
+
+    def status_pkgname(self, origin, pkgname):
+        """Query the install status of a port, given its package name."""
+        names = self._names.get(origin)
+        if names is None:
+            return ABSENT
+        pstatus = OLDER
+        portname, key = _parse(pkgname)
+        for installed in names.get(portname, ()):
+            pstatus = max(pstatus,
+                          CURRENT + cmp_version(_parse(installed)[1], key))
         return pstatus
 
+    def status_all(self, pkgnames):
+        """Query the install status of many ports, given a map of their
+        origins to package names, returning a map of origins to status.
+
+        Each package name is only parsed once (see version_key())."""
+        return dict((origin, self.status_pkgname(origin, pkgname))
+                    for origin, pkgname in pkgnames.iteritems())
+
+    def outdated(self, pkgnames):
+        """The installed ports that are older than the given package names
+        (a map of their origins to package names)."""
+        return set(origin for origin, pstatus in
+                   self.status_all(pkgnames).iteritems() if pstatus == OLDER)
+
+    def _add(self, origin, pkgname):
+        """Add a package to the database (and its indexes)."""
+        self.origins[pkgname] = origin
+        if origin in self.ports:
+            self.ports[origin].add(pkgname)
+        else:
+            self.ports[origin] = set((pkgname,))
+        names = self._names.setdefault(origin, {})
+        portname = _parse(pkgname)[0]
+        if portname in names:
+            names[portname].add(pkgname)
+        else:
+            names[portname] = set((pkgname,))
+
 db = PKGDB()
 repo_db = PKGDB(repo=True)
@@ -5,10 +5,13 @@ from __future__ import absolute_import
 
 import os
 
-__all__ = ["add", "change", "info", "query", "remove"]
+__all__ = ["add", "change", "fetch", "info", "load", "query", "remove"]
 
 suffix = ".tbz"
 
+#: The commands that accept several packages (i.e. arguments bar the package)
+batch = (("pkg_add",), ("pkg_add", "-r"))
+
 def add(port, repo=False, pkg_dir=None):
     """Add a package from port."""
     if repo:
@@ -27,6 +30,11 @@ def change(_port, prop, _value):
         assert not "unknown package property '%s'" % prop
 
 
+def fetch(_port):
+    """Fetch a repository package (not supported, pkg_add -r fetches)."""
+    return False
+
+
 def info(repo=False):
     """List all installed packages with their respective port origin."""
     if repo:
@@ -34,6 +42,11 @@ def info(repo=False):
     return ("pkg_info", "-aoQ")
 
 
+def load(_repo=False):
+    """Load the installed packages directly (not supported)."""
+    return False
+
+
 def query(_port, prop, _repo=False):
     """Query a property of a package."""
     if prop == "config":
@@ -3,14 +3,38 @@ The next generation package management tools (i.e. pkgng)..
 """
 from __future__ import absolute_import
 
+import glob
 import os
+import subprocess
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
 
 from libpb import env
 
-__all__ = ["add", "change", "info", "query", "remove"]
+__all__ = ["add", "change", "fetch", "info", "load", "query", "remove"]
 
 suffix = ".txz"
 
+#: The commands that accept several packages (i.e. arguments bar the package)
+batch = (("pkg", "add"), ("pkg", "install", "-y"))
+
+dbdir = "/var/db/pkg"  #: The default directory of pkgng's databases
+
+#: Queries for the options of the packages (for the various schemas)
+options_query = (
+    "SELECT p.name || '-' || p.version, o.option, po.value "
+    "FROM pkg_option AS po JOIN option AS o ON o.option_id = po.option_id "
+    "JOIN packages AS p ON p.id = po.package_id",
+    "SELECT p.name || '-' || p.version, o.option, o.value "
+    "FROM options AS o JOIN packages AS p ON p.id = o.package_id",
+  )
+
+#: Query for the location (in the repository) and checksum of the packages
+files_query = "SELECT name || '-' || version, path, cksum FROM packages"
+
 shell_pkg_add = """
 if [ ! -d %(wrkdir)s ]; then
     mkdir -p %(wrkdir)s;
@@ -57,6 +81,14 @@ def change(port, prop, value):
         assert not "unknown package property '%s'" % prop
 
 
+def fetch(port):
+    """Fetch the repository package for port into the package cache."""
+    # The repository catalogue is not updated, so the packages fetched are
+    # those recorded in the repository database loaded (and concurrent
+    # fetches do not contend for the database)
+    return ("pkg", "fetch", "-yU", port.attr["pkgname"])
+
+
 def info(repo=False):
     """List all installed packages with their respective port origin."""
     pkg_info = env.flags["chroot"] + "/usr/local/sbin/pkg"
@@ -68,6 +100,84 @@ def info(repo=False):
         return ("pkg", "query", "%n-%v:%o")
 
 
+def load(repo=False):
+    """Load the installed (or repository) packages with their respective port
+    origin, their options and (for repositories) the location and checksum of
+    their package files, directly from pkgng's databases."""
+    if sqlite3 is None:
+        return False
+    pkg_dbdir = env.flags["chroot"] + _dbdir()
+    if repo:
+        paths = glob.glob(os.path.join(pkg_dbdir, "repo*.sqlite"))
+    else:
+        paths = glob.glob(os.path.join(pkg_dbdir, "local.sqlite"))
+    if not paths:
+        return False
+
+    pkgdb = {}
+    options = {}
+    files = {} if repo else None
+    try:
+        for path in sorted(paths):
+            _load(path, pkgdb, options, files)
+    except sqlite3.Error:
+        return False
+    return pkgdb, options, files
+
+
+def _dbdir():
+    """The directory of pkgng's databases, as per $PKG_DBDIR or pkg's DBDIR
+    setting (see pkg.conf(5))."""
+    pkg_dbdir = os.environ.get("PKG_DBDIR")
+    if pkg_dbdir:
+        return pkg_dbdir
+    args = ("pkg", "config", "DBDIR")
+    if env.flags["chroot"]:
+        args = ("chroot", env.flags["chroot"]) + args
+    try:
+        config = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE, close_fds=True)
+        pkg_dbdir = config.communicate()[0].strip()
+    except OSError:
+        return dbdir
+    return pkg_dbdir if config.returncode == 0 and pkg_dbdir else dbdir
+
+
+def _load(path, pkgdb, options, files=None):
+    """Load the packages, and their options (and files), from a pkgng
+    database."""
+    if not os.path.isfile(path):
+        # sqlite3 would create the database
+        raise sqlite3.OperationalError("no such database: %s" % path)
+    conn = sqlite3.connect(path)
+    conn.text_factory = str
+    try:
+        # Make sure pkgng's database is not modified
+        conn.execute("PRAGMA query_only = ON")
+        for name, version, origin in conn.execute(
+                "SELECT name, version, origin FROM packages"):
+            pkgname = "%s-%s" % (name, version)
+            if origin in pkgdb:
+                pkgdb[origin].add(pkgname)
+            else:
+                pkgdb[origin] = set((pkgname,))
+        for query in options_query:
+            try:
+                cursor = conn.execute(query)
+            except sqlite3.OperationalError:
+                # Table does not exist for this schema
+                continue
+            for pkgname, option, value in cursor:
+                options.setdefault(pkgname, {})[option] = value
+            break
+        if files is not None:
+            for pkgname, repopath, cksum in conn.execute(files_query):
+                files[pkgname] = (repopath, cksum)
+    finally:
+        conn.close()
+
+
 def query(port, prop, repo=False):
     """Query q property of a package."""
     args = ("pkg", "rquery" if repo else "query", port.attr["pkgname"])
@@ -0,0 +1,254 @@
+"""Kernel event notification backends.
+
+Provides the system specific code used by the event manager to wait for file
+descriptors, timers, subprocesses and signals.  Each backend identifies an
+event by (ident, mode), where mode is one of:
+  r - Read a file descriptor (ident is the file descriptor)
+  w - Write to a file descriptor (ident is the file descriptor)
+  t - Periodic timer callback (ident is an alarm id)
+  p - Monitor a subprocess (ident is the process id)
+  s - Signal handling (ident is the signal number)
+"""
+from __future__ import absolute_import
+
+import errno
+import fcntl
+import math
+import os
+import select
+import signal
+import time
+
+__all__ = ["Backend", "EPoll", "KQueue", "backends"]
+
+
+def _retry(func, *args):
+    """Retry a system call if it was interrupted."""
+    while True:
+        try:
+            return func(*args)
+        except (IOError, OSError), e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+
+
+class KQueue(object):
+    """Event backend using kqueue(2)."""
+
+    name = "kqueue"
+
+    def __init__(self):
+        """Initialise the kqueue."""
+        self._kq = select.kqueue()
+
+    def register(self, obj, ident, mode, data=0):
+        """Start monitoring the event (ident, mode[0])."""
+        note = 0
+        if mode == "t":
+            data = int(data * 1000)
+        elif mode.startswith("p"):
+            if "f" in mode[1:]:
+                note |= select.KQ_NOTE_FORK
+            elif "e" in mode[1:]:
+                note |= select.KQ_NOTE_EXEC
+            elif "-" in mode[1:]:
+                if ISSUE11973:
+                    # HACK: work around python bug!!!
+                    note -= select.KQ_NOTE_EXIT
+                else:
+                    note |= select.KQ_NOTE_EXIT
+        kevent = select.kevent(ident, self.FILTERS[mode[0]],
+                               select.KQ_EV_ADD | select.KQ_EV_ENABLE,
+                               note, data)
+        self._kq.control((kevent,), 0)
+
+    def unregister(self, ident, mode):
+        """Stop monitoring the event (ident, mode)."""
+        self._kq.control((select.kevent(ident, self.FILTERS[mode],
+                                        select.KQ_EV_DELETE),), 0)
+
+    def control(self, max_events, timeout=None):
+        """Wait for events, returning ((ident, mode), finished) pairs."""
+        events = []
+        for ev in _retry(self._kq.control, None, max_events, timeout):
+            mode = self.MODES[ev.filter]
+            events.append(((ev.ident, mode),
+                           mode == "p" and ev.fflags == select.KQ_NOTE_EXIT))
+        return events
+
+
+class EPoll(object):
+    """Event backend using epoll(7).
+
+    Subprocess termination and signals are detected using a self-pipe (see
+    signal.set_wakeup_fd()) and timers are tracked in userland, adjusting the
+    timeout given to epoll accordingly."""
+
+    name = "epoll"
+
+    def __init__(self):
+        """Initialise the epoll object."""
+        self._epoll = select.epoll()
+        self._fds = {}       #: File descriptors and their modes
+        self._timers = {}    #: Timers and their [deadline, period]
+        self._procs = {}     #: Subprocesses being monitored
+        self._signals = {}   #: Signals (and previous handlers) being monitored
+        self._signalled = set()  #: Signals received
+        self._wakeup = None  #: Self-pipe woken by signals
+
+    def register(self, obj, ident, mode, data=0):
+        """Start monitoring the event (ident, mode[0])."""
+        if mode in ("r", "w"):
+            if ident in self._fds:
+                self._fds[ident].add(mode)
+                self._epoll.modify(ident, self._mask(self._fds[ident]))
+            else:
+                self._fds[ident] = set((mode,))
+                self._epoll.register(ident, self._mask(self._fds[ident]))
+        elif mode == "t":
+            self._timers[ident] = [time.time() + data, data]
+        elif mode.startswith("p"):
+            if "-" not in mode[1:]:
+                raise ValueError("unsupported subprocess event '%s'" % mode)
+            self._watch(signal.SIGCHLD)
+            self._procs[ident] = obj
+            # The subprocess may have died before the SIGCHLD handler was
+            # installed, check on the next call to control()
+            try:
+                os.write(self._wakeup[1], "\0")
+            except OSError, e:
+                if e.errno != errno.EAGAIN:
+                    raise
+        elif mode == "s":
+            handler = signal.getsignal(ident)
+            self._watch(ident)
+            self._signals[ident] = handler
+        else:
+            raise ValueError("unknown event mode")
+
+    def unregister(self, ident, mode):
+        """Stop monitoring the event (ident, mode)."""
+        if mode in ("r", "w"):
+            self._fds[ident].remove(mode)
+            if self._fds[ident]:
+                self._epoll.modify(ident, self._mask(self._fds[ident]))
+            else:
+                del self._fds[ident]
+                self._epoll.unregister(ident)
+        elif mode == "t":
+            del self._timers[ident]
+        elif mode == "p":
+            del self._procs[ident]
+        elif mode == "s":
+            signal.signal(ident, self._signals.pop(ident))
+            self._signalled.discard(ident)
+
+    def control(self, max_events, timeout=None):
+        """Wait for events, returning ((ident, mode), finished) pairs."""
+        now = time.time()
+        if self._timers:
+            deadline = min(i[0] for i in self._timers.values()) - now
+            if timeout is None or deadline < timeout:
+                # epoll truncates the timeout to milliseconds, round up so as
+                # not to spin before the timer is due
+                timeout = max(0, math.ceil(deadline * 1000) / 1000.0)
+        if timeout is None:
+            timeout = -1
+        wakeup = self._wakeup[0] if self._wakeup else None
+
+        events = []
+        for fd, mask in _retry(self._epoll.poll, timeout, max_events):
+            if fd == wakeup:
+                self._drain()
+                continue
+            modes = self._fds.get(fd, ())
+            if "r" in modes and mask & (select.EPOLLIN | select.EPOLLHUP |
+                                        select.EPOLLERR):
+                events.append(((fd, "r"), False))
+            if "w" in modes and mask & (select.EPOLLOUT | select.EPOLLERR):
+                events.append(((fd, "w"), False))
+
+        now = time.time()
+        for ident, timer in self._timers.items():
+            if timer[0] <= now:
+                timer[0] += timer[1]
+                if timer[0] <= now:
+                    # Skip missed periods
+                    timer[0] = now + timer[1]
+                events.append(((ident, "t"), False))
+
+        while self._signalled:
+            signum = self._signalled.pop()
+            if signum == signal.SIGCHLD:
+                for pid, proc in self._procs.items():
+                    if proc.poll() is not None:
+                        del self._procs[pid]
+                        events.append(((pid, "p"), True))
+            if signum in self._signals:
+                events.append(((signum, "s"), False))
+        return events
+
+    @staticmethod
+    def _mask(modes):
+        """Convert the file descriptor modes into an epoll event mask."""
+        mask = 0
+        if "r" in modes:
+            mask |= select.EPOLLIN
+        if "w" in modes:
+            mask |= select.EPOLLOUT
+        return mask
+
+    def _watch(self, signum):
+        """Install a signal handler that wakes up the epoll object."""
+        if self._wakeup is None:
+            self._wakeup = os.pipe()
+            for fd in self._wakeup:
+                flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            signal.set_wakeup_fd(self._wakeup[1])
+            self._epoll.register(self._wakeup[0], select.EPOLLIN)
+        if signal.getsignal(signum) != self._handler:
+            signal.signal(signum, self._handler)
+            signal.siginterrupt(signum, False)
+
+    def _handler(self, signum, _frame):
+        """Record a signal for the next call to control()."""
+        self._signalled.add(signum)
+
+    def _drain(self):
+        """Empty the self-pipe."""
+        try:
+            while os.read(self._wakeup[0], 512):
+                pass
+        except OSError, e:
+            if e.errno not in (errno.EAGAIN, errno.EINTR):
+                raise
+        # Registrations (and lost wakeups) need the subprocesses checked
+        if self._procs:
+            self._signalled.add(signal.SIGCHLD)
+
+
+backends = []
+
+if hasattr(select, "kqueue"):
+    try:
+        select.kevent(0, 0, 0, select.KQ_NOTE_EXIT, 0, 0)
+        ISSUE11973 = False
+    except OverflowError:
+        ISSUE11973 = True
+
+    KQueue.FILTERS = {
+            "r": select.KQ_FILTER_READ,
+            "w": select.KQ_FILTER_WRITE,
+            "t": select.KQ_FILTER_TIMER,
+            "p": select.KQ_FILTER_PROC,
+            "s": select.KQ_FILTER_SIGNAL,
+        }
+    KQueue.MODES = dict((j, i) for i, j in KQueue.FILTERS.items())
+    backends.append(KQueue)
+
+if hasattr(select, "epoll"):
+    backends.append(EPoll)
+
+Backend = backends[0] if backends else None
@@ -21,14 +21,14 @@ class PortCache(object):
     def get_port(self, origin):
         """Get a port and callback with it."""
         if origin in self._ports:
-            sig = signal.Signal()
+            sig = signal.Signal(oneshot=True)
             event.post_event(sig.emit, self._ports[origin])
             return sig
         else:
             if origin in self._waiters:
                 return self._waiters[origin]
             else:
-                sig = signal.Signal()
+                sig = signal.Signal(oneshot=True)
                 self._waiters[origin] = sig
                 mk.attr(origin).connect(self._attr)
                 return sig
@@ -2,9 +2,8 @@
 
 from __future__ import absolute_import
 
-import collections
-
 from libpb import env, event, log, pkg, signal, stacks
+from libpb.port import priority
 
 __all__ = ['Dependent', 'Dependency']
 
@@ -12,6 +11,8 @@ __all__ = ['Dependent', 'Dependency']
 class DependHandler(object):
     """Common declarations to both Dependent and Dependency."""
 
+    __slots__ = ()
+
     # The type of dependencies
     BUILD   = 0
     EXTRACT = 1
@@ -36,6 +37,10 @@ class DependHandler(object):
       stacks.RepoInstall: (LIB, RUN, PKG),
     }
 
+    #: The dependencies for a given stage, as a mask of (1 << type)
+    STAGE2MASK = dict((stage, sum(1 << i for i in depends))
+                      for stage, depends in STAGE2DEPENDS.iteritems())
+
 
 class Dependent(DependHandler):
     """Tracks the dependants for a Port."""
@@ -45,10 +50,14 @@ class Dependent(DependHandler):
     UNRESOLV = 0   #: Port does not satisfy dependants
     RESOLV   = 1   #: Dependants resolved
 
+    __slots__ = ("_dependants", "_ports", "_resolved", "port", "priority",
+                 "status")
+
     def __init__(self, port):
         """Initialise the databases of dependants."""
         DependHandler.__init__(self)
-        self._dependants = [[], [], [], [], [], [], []]  #: All dependants
+        self._dependants = {}  #: All dependants (per type of dependency)
+        self._ports = {}  #: Dependants and their number of dependency types
         self.port = port  #: The port whom we handle
         self.priority = port.priority
         if port.install_status > env.flags["buildstatus"]:
@@ -56,6 +65,8 @@ class Dependent(DependHandler):
             # TODO: Change to actually check if we are resolved
         else:
             self.status = Dependent.UNRESOLV
+        # NB: the port has no flags yet (see Port.resolved())
+        self._resolved = self.status == Dependent.RESOLV  #: Port resolved
 
     def __repr__(self):
         return "<Dependent(port=%s)>" % self.port.origin
@@ -65,20 +76,20 @@ class Dependent(DependHandler):
         if self.status == Dependent.RESOLV:
             if not self._update(field, typ):
                 self.status = Dependent.UNRESOLV
+                self._resolved = False
                 self._notify_all()
 
-        self._dependants[typ].append((field, port))
+        self._dependants.setdefault(typ, []).append((field, port))
+        self._ports[port] = self._ports.get(port, 0) + 1
 
     def get(self, stage=None):
         """Retrieve a list of dependants."""
         if stage is None:
-            depends = set()
-            for i in self._dependants:
-                depends.update(j[1] for j in i)
+            depends = set(self._ports)
         else:
             depends = set()
             for i in DependHandler.STAGE2DEPENDS[stage]:
-                depends.update(j[1] for j in self._dependants[i])
+                depends.update(j[1] for j in self._dependants.get(i, ()))
 
         return depends
 
@@ -103,13 +114,29 @@ class Dependent(DependHandler):
         else:
             status = Dependent.FAILURE if exhausted else Dependent.UNRESOLV
 
-        if status != self.status:
-            self.status = status
+        # The port may become (un)resolved without its status changing (e.g.
+        # when upgraded)
+        changed = status != self.status
+        self.status = status
+        if changed or self._resolved != self.port.resolved():
+            self._resolved = self.port.resolved()
             self._notify_all()
 
+    def remove(self, port):
+        """Remove a dependant from our list (i.e. a retired port)."""
+        if self._ports.pop(port, None) is not None:
+            for typ, dependants in self._dependants.items():
+                self._dependants[typ] = [i for i in dependants
+                                         if i[1] is not port]
+
+    def retire(self):
+        """Forget the dependants, once they have all finished."""
+        self._dependants = {}
+        self._ports = {}
+
     def _notify_all(self):
         """Notify all dependants that we have changed status."""
-        for i in self.get():
+        for i in self._ports:
             i.dependency.update(self)
 
     def _update(self, _field, typ):
@@ -138,8 +165,8 @@ class Dependent(DependHandler):
 
     def _verify(self):
         """Check that we actually satisfy all dependants."""
-        for i in range(len(self._dependants)):
-            for j in self._dependants[i]:
+        for i, dependants in self._dependants.iteritems():
+            for j in dependants:
                 if not self._update(j[0], i):
                     return False
         return True
@@ -148,6 +175,9 @@ class Dependent(DependHandler):
 class Dependency(DependHandler):
     """Tracks the dependencies for a Port."""
 
+    __slots__ = ("_dependencies", "_ports", "_unresolved", "_loading", "_bad",
+                 "failed", "port", "__weakref__")
+
     loaded = signal.SignalProperty()
 
     def __init__(self, port, depends=None):
@@ -155,8 +185,9 @@ class Dependency(DependHandler):
         from . import get_port
 
         DependHandler.__init__(self)
-        self._count = 0  #: The count of outstanding dependencies
-        self._dependencies = [[], [], [], [], [], [], []]  #: All dependencies
+        self._dependencies = {}  #: All dependencies (per type of dependency)
+        self._ports = {}  #: Dependencies and their types (as a mask)
+        self._unresolved = set()  #: Dependencies not yet resolved
         self._loading = 0  #: Number of dependencies left to load
         self._bad = 0  #: Number of bad dependencies
         self.failed = False  #: If a dependency has failed
@@ -177,7 +208,6 @@ class Dependency(DependHandler):
                 self._loading += 1
                 get_port(j[1]).connect(adder(j[0], i))
         if not self._loading:
-            self._update_priority()
             event.post_event(self.loaded.emit, True)
 
     def __repr__(self):
@@ -189,12 +219,17 @@ class Dependency(DependHandler):
 
         if not isinstance(port, str):
             status = port.dependent.status
-            if port not in self._dependencies[typ]:
-                self._dependencies[typ].append(port)
+            if port not in self._dependencies.get(typ, ()):
+                if port in self._ports:
+                    self._ports[port] |= 1 << typ
+                else:
+                    self._ports[port] = 1 << typ
+                    priority.add_depend(self.port, port)
+                self._dependencies.setdefault(typ, []).append(port)
                 port.dependent.add(field, self.port, typ)
 
-                if status != Dependent.RESOLV:
-                    self._count += 1
+                if not port.resolved():
+                    self._unresolved.add(port)
         else:
             log.error("Dependency._add()",
                       "Port '%s': failed to load dependency '%s'" %
@@ -210,28 +245,61 @@ class Dependency(DependHandler):
                 self.failed = True
 
         if self._loading == 0:
-            self._update_priority()
             self.loaded.emit(not self._bad)
 
     def get(self, stage=None):
         """Retrieve a list of dependencies."""
         if stage is None:
-            depends = set()
-            for i in self._dependencies:
-                depends.update(i)
+            depends = set(self._ports)
         else:
             depends = set()
             for i in DependHandler.STAGE2DEPENDS[stage]:
-                depends.update(self._dependencies[i])
+                depends.update(self._dependencies.get(i, ()))
 
         return depends
 
     def check(self, stage):
-        """Check the dependency status for a given stage."""
-        # DependHandler status might change without Port's changing
-        bad = set()
-        for i in DependHandler.STAGE2DEPENDS[stage]:
-            bad.update(j for j in self._dependencies[i] if not j.resolved())
+        """Check the dependency status for a given stage.
+
+        The unresolved dependencies are tracked as the dependencies change
+        status (see update()), and agree with those found by checking each
+        dependency (see _check()), for example (for random changes to a
+        random graph of ports):
+
+        >>> import random
+        >>> class Port(object):
+        ...     def __init__(self, origin):
+        ...         self.origin = origin
+        ...         self.priority = 0
+        ...         self.install_status = random.choice((pkg.ABSENT,
+        ...                                              pkg.CURRENT))
+        ...         self.dependent = Dependent(self)
+        ...         self.dependency = Dependency(self)
+        ...     def resolved(self):
+        ...         return (self.install_status > env.flags["buildstatus"] and
+        ...                 self.dependent.status == Dependent.RESOLV)
+        >>> random.seed(13)
+        >>> ports = [Port("category/port%i" % i) for i in range(50)]
+        >>> for i in range(1, len(ports)):
+        ...     for depend in random.sample(ports[:i], min(i, 4)):
+        ...         ports[i].dependency._loading += 1
+        ...         ports[i].dependency._add(depend, "", random.randrange(7))
+        >>> consistent = True
+        >>> for _ in range(200):
+        ...     port = random.choice(ports)
+        ...     port.install_status = pkg.CURRENT - port.install_status
+        ...     port.dependent.status_changed()
+        ...     consistent &= all(i.dependency.check(j) ==
+        ...                       i.dependency._check(j) for i in ports
+        ...                       for j in DependHandler.STAGE2DEPENDS)
+        >>> consistent
+        True
+        """
+        mask = DependHandler.STAGE2MASK[stage]
+        bad = set(i for i in self._unresolved if self._ports[i] & mask)
+        if env.flags["trace"] == "full":
+            # Cross-check the unresolved dependencies against the ports
+            assert bad == self._check(stage)
         return bad
 
     def update(self, depend):
@@ -241,33 +309,16 @@ class Dependency(DependHandler):
             self.failed = True
             if not self.port.dependent.failed:
                 self.port.dependent.status_changed()
-            delta = -1
-        elif status == Dependent.RESOLV:
-            delta = 1
-        else: # depend.status() == DependHandler.UNRESOLV
-            delta = -1
-
-        self._count -= (delta * len([i for i in sum(self._dependencies, [])
-                                             if i == depend]))
-        if self._count < 0:
-            self._count = 0
-        if not self._count:
-            # Check that we do actually have all the dependencies met
-            # TODO: Remove, debug check
-            for i in self.get():
-                if i.dependent.status != Dependent.RESOLV:
-                    self._count += 1
-
-    def _update_priority(self):
-        """Update the priority of all ports that are affected by this port,"""
-        update_list = collections.deque()
-        updated = set()
-        update_list.extend(self.get())
-        priority = self.port.dependent.priority
-        while len(update_list):
-            port = update_list.popleft()
-            if port not in updated:
-                port.dependent.priority += priority
-                if port.dependency is not None:
-                    update_list.extend(port.dependency.get())
-                updated.add(port)
+
+        if depend.port.resolved():
+            self._unresolved.discard(depend.port)
+        else:
+            self._unresolved.add(depend.port)
+
+    def _check(self, stage):
+        """Check the dependency status for a given stage, from the ports."""
+        bad = set()
+        for i in DependHandler.STAGE2DEPENDS[stage]:
+            bad.update(j for j in self._dependencies.get(i, ())
+                       if not j.resolved())
+        return bad
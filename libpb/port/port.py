@@ -4,7 +4,7 @@ from __future__ import absolute_import, with_statement
 
 import os
 
-from libpb import env, log, make, pkg, stacks
+from libpb import env, log, make, mk, pkg, stacks
 
 __all__ = ["Port"]
 
@@ -19,18 +19,19 @@ class Port(object):
     A FreeBSD port class.
     """
 
+    __slots__ = ("attr", "flags", "load", "origin", "priority", "stages",
+                 "stacks", "install_status", "dependency", "dependent")
+
     def __init__(self, origin, attr):
         """Initialise the port with the required information."""
         from .dependhandler import Dependent
-        from ..env import flags
 
-        self.attr = attr
-        self.log_file = os.path.join(flags["log_dir"], self.attr["pkgname"])
+        self.attr = mk.PortAttr(attr)
         self.flags = set()
         self.load = attr["jobs_number"]
         self.origin = origin
         self.priority = 0
-        self.stages = set((None,))
+        self.stages = stacks.StageSet()
         self.stacks = dict((i, stacks.Stack(i)) for i in ("common", "build",
                                                           "package", "repo"))
 
@@ -45,6 +46,11 @@ class Port(object):
     def __repr__(self):
         return "<Port(%s)>" % (self.origin)
 
+    @property
+    def log_file(self):
+        """The port's log file."""
+        return os.path.join(env.flags["log_dir"], self.attr["pkgname"])
+
     def resolved(self):
         """Indicate if the port meets it's dependents."""
         # TODO: use Dependent.RESOLV (current import issues)
@@ -58,6 +64,21 @@ class Port(object):
         return (self.install_status > status and
                 self.dependent.status == RESOLV)
 
+    def retire(self):
+        """Release the resources of a resolved port no longer needed by its
+        dependants.
+
+        The port keeps its origin, package name, flags and status, as used to
+        report on and monitor the port."""
+        self.flags.add("retired")
+        self.attr.release("options", "distfiles")
+        if self.dependency is not None:
+            # The dependencies may still change status, and notify us
+            for port in self.dependency.get():
+                port.dependent.remove(self)
+        self.dependency = None
+        self.dependent.retire()
+
     def clean(self, force=False):
         """Remove port's working director and log files."""
         if stacks.Build in self.stages or force:
@@ -0,0 +1,125 @@
+"""Priority propagation for ports.
+
+A port's priority (Dependent.priority) is the length of the longest chain of
+work waiting on the port: its own weight (Port.priority, its expected build
+time, see libpb.history) plus the largest priority of its dependants.  Ports
+on the critical path are thus started first.  Changes are accumulated and
+pushed along the dependency edges once per batch of events."""
+
+from __future__ import absolute_import
+
+from libpb import event
+
+__all__ = ["PriorityEngine", "add_depend", "add_weight", "engine"]
+
+
+class PriorityEngine(object):
+    """Maintain the priority of ports as their dependency graph grows."""
+
+    def __init__(self):
+        """Initialise the priority engine."""
+        self._weight = {}  #: Pending changes in ports' own weight
+        self._longest = {}  #: Pending priorities of ports' dependants
+        self._posted = False  #: Indicates if a flush has been posted
+
+    def add_weight(self, port, weight):
+        """Add to a port's own weight."""
+        if weight:
+            self._weight[port] = self._weight.get(port, 0) + weight
+            self._post()
+
+    def add_depend(self, port, depend):
+        """Add a dependency to a port.
+
+        The dependency's chain of work grows to include the port's.  The port's
+        pending changes will reach the dependency when they are flushed."""
+        self._add_longest(depend, port.dependent.priority)
+
+    def flush(self):
+        """Propagate pending changes in priority (in topological order)."""
+        from ..builder import builders
+
+        self._posted = False
+        weight, self._weight = self._weight, {}
+        longest, self._longest = self._longest, {}
+        if not weight and not longest:
+            return
+
+        # Find all affected ports and count their affected dependants
+        depends = {}
+        dependants = dict((port, 0) for port in weight)
+        dependants.update((port, 0) for port in longest)
+        stack = list(dependants)
+        while stack:
+            port = stack.pop()
+            if port.dependency is not None:
+                depends[port] = port.dependency.get()
+            else:
+                depends[port] = ()
+            for i in depends[port]:
+                if i in dependants:
+                    dependants[i] += 1
+                else:
+                    dependants[i] = 1
+                    stack.append(i)
+
+        changed = []
+        ready = [port for port, count in dependants.iteritems() if not count]
+        while ready:
+            port = ready.pop()
+            if self._update(port, weight, longest):
+                changed.append(port)
+                for i in depends[port]:
+                    self._add_longest(i, port.dependent.priority, longest)
+            for i in depends[port]:
+                dependants[i] -= 1
+                if not dependants[i]:
+                    ready.append(i)
+        # Ports on a dependency cycle are not propagated any further
+        for port in set(weight).union(longest):
+            if self._update(port, weight, longest):
+                changed.append(port)
+
+        # Reposition the queued jobs of the changed ports
+        for builder in builders.values():
+            if builder.queue is not None:
+                for port in changed:
+                    if port in builder.ports:
+                        builder.queue.update(builder.ports[port])
+
+    @staticmethod
+    def _update(port, weight, longest):
+        """Apply the pending changes to a port, indicating if it changed."""
+        own = port.priority
+        rest = port.dependent.priority - own
+        if port in weight:
+            own += weight.pop(port)
+            port.priority = own
+        if port in longest:
+            rest = max(rest, longest.pop(port))
+        if own + rest != port.dependent.priority:
+            port.dependent.priority = own + rest
+            return True
+        return False
+
+    def _add_longest(self, port, priority, longest=None):
+        """Record a pending priority of one of the port's dependants."""
+        if longest is None:
+            if not priority:
+                return
+            longest = self._longest
+            self._post()
+        if priority > longest.get(port, 0):
+            longest[port] = priority
+
+    def _post(self):
+        """Post a flush of the pending changes, if needed."""
+        if not self._posted:
+            self._posted = True
+            event.post_event(self.flush)
+
+
+engine = PriorityEngine()
+
+add_depend = engine.add_depend
+add_weight = engine.add_weight
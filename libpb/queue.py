@@ -2,30 +2,172 @@
 
 from __future__ import absolute_import
 
-import bisect
+import functools
+import heapq
+import itertools
 
 from libpb import env
 
 __all__ = [
-        "QueueManager", "queues", "attr", "config", "checksum", "fetch",
-        "build", "install"
+        "JobHeap", "QueueManager", "queues", "attr", "config", "checksum",
+        "fetch", "build", "install"
     ]
 
 
+class JobHeap(object):
+    """A priority queue of jobs, ordered as per Job.__lt__().
+
+    Jobs are bucketed by load, with a heap per load, so that the highest
+    priority job that fits a given load can be found in O(b log n) (where b is
+    the number of distinct loads).  Entries are invalidated lazily, allowing
+    jobs to be removed and reprioritised in O(log n).  Jobs of equal priority
+    are returned in the order they were added."""
+
+    def __init__(self):
+        """Initialise an empty heap."""
+        self._buckets = {}   #: Heaps of [-priority, sequence, job] per load
+        self._entries = {}   #: Mapping of jobs to their (valid) entries
+        self._invalid = 0    #: Number of invalidated entries in the heaps
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, job):
+        return job in self._entries
+
+    def __iter__(self):
+        """Iterate over the jobs, in priority order."""
+        return iter([entry[-1] for entry in sorted(self._entries.values())])
+
+    def push(self, job):
+        """Add a job to the heap."""
+        assert job not in self._entries
+        self._push([-job.priority, self._sequence.next(), job])
+
+    def peek(self):
+        """Return the highest priority job (irrespective of load)."""
+        best = None
+        for load in self._buckets.keys():
+            entry = self._top(load)
+            if entry is not None and (best is None or entry < best):
+                best = entry
+        if best is None:
+            raise IndexError("peek from empty heap")
+        return best[-1]
+
+    def pop(self, load=None):
+        """Remove the highest priority job, with at most load if possible.
+
+        If no job has at most load then the highest priority job with the
+        smallest load is returned."""
+        best = None
+        smallest = None
+        for bucket in self._buckets.keys():
+            entry = self._top(bucket)
+            if entry is None:
+                continue
+            if load is None or bucket <= load:
+                if best is None or entry < best:
+                    best = entry
+            elif smallest is None or bucket < smallest:
+                smallest = bucket
+        if best is None:
+            if smallest is None:
+                raise IndexError("pop from empty heap")
+            best = self._top(smallest)
+        job = best[-1]
+        heapq.heappop(self._buckets[job.load])
+        del self._entries[job]
+        return job
+
+    def remove(self, job):
+        """Remove a job from the heap."""
+        try:
+            entry = self._entries.pop(job)
+        except KeyError:
+            raise ValueError("job not in heap")
+        self._invalidate(entry)
+
+    def update(self, job):
+        """Reposition a job whose priority has changed."""
+        entry = self._entries.get(job)
+        if entry is not None and entry[0] != -job.priority:
+            self._invalidate(entry)
+            self._push([-job.priority, entry[1], job])
+
+    def reorder(self):
+        """Reposition all jobs as their priorities may have changed."""
+        entries = self._entries.values()
+        self._buckets = {}
+        self._entries = {}
+        self._invalid = 0
+        for entry in entries:
+            job = entry[-1]
+            entry = [-job.priority, entry[1], job]
+            self._entries[job] = entry
+            self._buckets.setdefault(job.load, []).append(entry)
+        for heap in self._buckets.values():
+            heapq.heapify(heap)
+
+    def _push(self, entry):
+        """Add an entry to the heap for its load."""
+        job = entry[-1]
+        self._entries[job] = entry
+        if job.load in self._buckets:
+            heapq.heappush(self._buckets[job.load], entry)
+        else:
+            self._buckets[job.load] = [entry]
+
+    def _top(self, load):
+        """Return the top, valid, entry for the given load."""
+        heap = self._buckets[load]
+        while heap and heap[0][-1] is None:
+            heapq.heappop(heap)
+            self._invalid -= 1
+        if not heap:
+            del self._buckets[load]
+            return None
+        return heap[0]
+
+    def _invalidate(self, entry):
+        """Invalidate an entry, compacting the heaps if required."""
+        entry[-1] = None
+        self._invalid += 1
+        if self._invalid > len(self._entries) + 64:
+            for load, heap in self._buckets.items():
+                heap = [i for i in heap if i[-1] is not None]
+                if heap:
+                    heapq.heapify(heap)
+                    self._buckets[load] = heap
+                else:
+                    del self._buckets[load]
+            self._invalid = 0
+
+
 class QueueManager(object):
     """Manages jobs and runs them as resources come available."""
 
-    def __init__(self, load=1):
-        """Initialise the manager with an indication of load available."""
+    def __init__(self, load=1, reserve=False):
+        """Initialise the manager with an indication of load available.
+
+        If reserve is set then no job will be started ahead of a higher
+        priority job that does not fit the remaining load, allowing the load
+        to drain until the high priority job fits."""
         self._load = load
         self._sort = False
-        self.queue = []
+        self.reserve = reserve
+        self.queue = JobHeap()
         self.active = []
-        self.stalled = []
+        self.shared = {}  #: Active jobs run together: (leader, active jobs)
+        self.stalled = JobHeap()
+        self.waiting = set()
         self.active_load = 0
+        self.stalls = 0  #: Number of times a job stalled
 
     def __len__(self):
-        return len(self.queue) + len(self.active) + len(self.stalled)
+        return (len(self.queue) + len(self.active) + len(self.stalled) +
+                len(self.waiting))
 
     @property
     def load(self):  # pylint: disable-msg=E0202
@@ -35,7 +177,8 @@ class QueueManager(object):
     @load.setter  # pylint: disable-msg=E1101
     def load(self, load):  # pylint: disable-msg=E0202,E0102
         """Set the load and start jobs as required."""
-        run = load > self._load
+        # Jobs started before the load was lowered may still exceed the load
+        run = load > self._load and self.active_load < load
         self._load = load
         if run:
             self._run()
@@ -43,17 +186,14 @@ class QueueManager(object):
     def add(self, job):
         """Add a job to be run."""
         assert(job not in self.queue)
-        if self._sort:
-            self.queue.append(job)
-        else:
-            bisect.insort(self.queue, job)
+        self.queue.push(job)
         if self.active_load < self._load:
             self._run()
 
     def done(self, job):
         """Indicates a job has completed."""
         self.active.remove(job)
-        self.active_load -= job.load
+        self._release(job)
         if self.active_load < self._load:
             self._run()
 
@@ -69,6 +209,12 @@ class QueueManager(object):
             return False
         return True
 
+    def update(self, job):
+        """Indicate a queued job's priority has changed."""
+        if not self._sort:
+            self.queue.update(job)
+            self.stalled.update(job)
+
     def _run(self):
         """Fills up the remaining load with jobs"""
         from .job import StalledJob
@@ -77,38 +223,72 @@ class QueueManager(object):
         stalled = []
         if self._sort:
             self._sort = False
-            self.stalled.sort()
-            self.queue.sort()
+            self.stalled.reorder()
+            self.queue.reorder()
         for queue in (self.stalled, self.queue):
             while self.active_load < self._load and len(queue):
-                job = self._find_job(self._load - self.active_load, queue)
-                try:
-                    self.active_load += job.load
-                    self.active.append(job)
-                    job.run(self)
-                except StalledJob:
-                    self.active_load -= job.load
-                    self.active.remove(job)
-                    stalled.append(job)
-        if len(stalled):
-            self.stalled.extend(stalled)
-            self.stalled.sort()
-
-    @staticmethod
-    def _find_job(load, queue):
-        """Find a job from queue that has at most load."""
-        best_job = queue[0]
-        best_idx = 0
-        if best_job.load <= load:
-            return queue.pop(0)
-        for idx in range(1, len(queue)):
-            job = queue[idx]
-            if job.load <= load:
-                return queue.pop(idx)
-            if best_job.load > job.load:
-                best_job = job
-                best_idx = idx
-        return queue.pop(best_idx)
+                load = self._load - self.active_load
+                if self.reserve:
+                    # Start the jobs in order of priority (from either heap)
+                    heap = min((i for i in (self.stalled, self.queue)
+                                if len(i)), key=JobHeap.peek)
+                    job = heap.peek()
+                    if job.load > load and self.active_load:
+                        # Reserve the remaining load for the job
+                        break
+                    heap.remove(job)
+                else:
+                    heap = queue
+                    job = heap.pop(load)
+                if job.load > load:
+                    # NB: the job may need more than the manager's load
+                    job.fit(load)
+                self.active_load += job.load
+                jobs = [job]
+                # Queued jobs that can be run with the job share its load,
+                # until all of them have finished
+                for i in job.coalesce(heap):
+                    heap.remove(i)
+                    jobs.append(i)
+                if len(jobs) > 1:
+                    group = set(jobs)
+                    for i in jobs:
+                        self.shared[i] = (job, group)
+                for job in jobs:
+                    try:
+                        self.active.append(job)
+                        job.run(self)
+                    except StalledJob, e:
+                        self.active.remove(job)
+                        self._release(job)
+                        self.stalls += 1
+                        if e.wakeup is None:
+                            stalled.append(job)
+                        else:
+                            # Wait for the contended resource to be released
+                            self.waiting.add(job)
+                            e.wakeup.connect(functools.partial(self._wakeup,
+                                                               job))
+        for job in stalled:
+            self.stalled.push(job)
+
+    def _release(self, job):
+        """Release the load of a job, once all jobs sharing it are done."""
+        if job in self.shared:
+            leader, group = self.shared.pop(job)
+            group.remove(job)
+            if group:
+                return
+            job = leader
+        self.active_load -= job.load
+
+    def _wakeup(self, job):
+        """Retry a stalled job, its contended resource has been released."""
+        if job in self.waiting:
+            self.waiting.remove(job)
+            self.stalled.push(job)
+            if self.active_load < self._load:
+                self._run()
 
 
 attr  = QueueManager(env.CPUS)
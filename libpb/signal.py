@@ -2,76 +2,129 @@
 
 from __future__ import absolute_import
 
+import itertools
 import time
 import weakref
 
-from libpb import log
+from libpb import env, log
 
 __all__ = ["Signal", "SignalProperty"]
 
+NO_TB = (None, 0)  #: Connection traceback when not tracing connections
+
+_order = itertools.count()  #: The order in which slots are connected
+
 
 class Signal(object):
-    """Allows signals to be sent to connected slots."""
+    """Allows signals to be sent to connected slots.
+
+    Slots are stored in a dictionary (mapping the slot to the order it was
+    connected) that is only created once a slot is connected.  A one-shot
+    signal forgets its slots once emitted."""
 
-    def __init__(self, name=""):
+    __slots__ = ("_slots", "_tb", "_name", "_oneshot")
+
+    def __init__(self, name="", oneshot=False):
         """Initialising the signal."""
-        self._slots = []  #: The slots connected to the signal
-        self._tb = {}
+        self._slots = None  #: The slots connected to the signal (and order)
+        self._tb = None  #: The tracebacks of the slots' connection
         self._name = name
+        self._oneshot = oneshot
 
     def __repr__(self):
         return "<%s(%s)>" % (self.__class__.__name__, self._name)
 
     def connect(self, slot):
-        """Connect a callback function to the signal."""
+        """Connect a callback function to the signal.
+
+        Connecting a slot that is already connected does nothing (the slot
+        keeps its calling order)."""
         if slot is not None:
-            self._slots.append(slot)
-            self._tb[slot] =  (log.get_tb(), time.time())
+            if self._slots is None:
+                self._slots = {}
+            elif slot in self._slots:
+                return self
+            self._slots[slot] = _order.next()
+            if env.flags["trace"] == "full":
+                if self._tb is None:
+                    self._tb = {}
+                self._tb[slot] = (log.get_tb(), time.time())
         return self
 
     def disconnect(self, slot):
         """Disconnect a callback function to the signal."""
-        if slot not in self._slots:
+        if not self.has_slot(slot):
             raise RuntimeError("%s: Slot is not connected: %s" %
                                (repr(self), str(slot)))
-        self._slots.remove(slot)
-        self._tb.pop(slot)
+        del self._slots[slot]
+        if self._tb is not None:
+            self._tb.pop(slot, None)
         return self
 
     def replace(self, oldslot, newslot):
         """Replace a slot with a different one (to maintain calling order)."""
-        if oldslot not in self._slots:
+        if not self.has_slot(oldslot):
             raise RuntimeError("%s: Slot not connected to this signal, cannot "
                                "be replaced: %s" % (repr(self), str(oldslot)))
-        self._slots[self._slots.index(oldslot)] = newslot
-        self._tb.pop(oldslot)
-        self._tb[newslot] = log.get_tb()
+        self._slots[newslot] = self._slots.pop(oldslot)
+        if self._tb is not None:
+            self._tb.pop(oldslot, None)
+        if env.flags["trace"] == "full":
+            if self._tb is None:
+                self._tb = {}
+            self._tb[newslot] = (log.get_tb(), time.time())
         return self
 
     reconnect = replace
 
     def slot_index(self, slot):
         """Return the calling order of the slot (starting from 0)."""
-        return self._slots.index(slot)
+        if not self.has_slot(slot):
+            raise ValueError("slot not connected")
+        return self._ordered().index(slot)
 
     def has_slot(self, slot):
         """Indicates if this signal has the slot."""
-        return slot in self._slots
+        return self._slots is not None and slot in self._slots
 
     def emit(self, *args, **kwargs):
         """Emit a signal."""
         from .event import post_event
 
-        for slot in self._slots:
-            post_event((slot, args, kwargs) + self._tb[slot])
+        if not self._slots:
+            return
+        slots = self._ordered()
+        tb = self._tb
+        if self._oneshot:
+            self._slots = self._tb = None
+        if tb is None:
+            # A single event calls all the slots
+            post_event((slots, args, kwargs, None, 0))
+        else:
+            for slot in slots:
+                post_event((slot, args, kwargs) + tb.get(slot, NO_TB))
+
+    def _ordered(self):
+        """The slots, in calling order."""
+        slots = self._slots
+        if len(slots) == 1:
+            return tuple(slots)
+        return tuple(sorted(slots, key=slots.get))
 
 
 class InlineSignal(Signal):
     """Sends signals inline."""
 
+    __slots__ = ()
+
     def emit(self, *args, **kwargs):
         """Emit a signal."""
-        for slot in self._slots:
+        if not self._slots:
+            return
+        slots = self._ordered()
+        if self._oneshot:
+            self._slots = self._tb = None
+        for slot in slots:
             slot(*args, **kwargs)
 
 
@@ -0,0 +1,129 @@
+"""Cache of the ports' attributes.
+
+The attributes of each port (and thus the dependency graph) are cached, and
+saved between runs, along with a fingerprint of the files used to generate
+them (the Makefiles listed in the "makefiles" attribute and the options file)
+and of the make environment.  Only ports whose fingerprint has changed need
+their attributes fetched from make."""
+
+from __future__ import absolute_import
+
+import collections
+import cPickle
+import hashlib
+import os
+
+from libpb import env, log
+
+__all__ = ["Snapshot", "db"]
+
+VERSION = 2  #: Format of the snapshot file
+
+
+class Snapshot(object):
+    """A least recently used cache of port attributes, validated by the
+    contents of their Makefiles."""
+
+    def __init__(self, size=32768):
+        """Initialise an empty cache, holding at most size ports."""
+        self.size = size
+        self._attrs = collections.OrderedDict()  #: Per port: (attr, files,
+                                                 #: optionsfile, fingerprint)
+        self._digests = {}  #: Digest of the Makefiles
+        self._environ = None  #: The make environment
+        self.hits = 0    #: Number of ports found in the cache
+        self.misses = 0  #: Number of ports not found (or stale) in the cache
+
+    def __len__(self):
+        return len(self._attrs)
+
+    def load(self):
+        """Load the cache saved by a previous run."""
+        self._attrs = collections.OrderedDict()
+        self._digests = {}
+        self._environ = None
+        if not env.flags["snapshot"]:
+            return
+        try:
+            with open(env.flags["snapshot"], "rb") as snapshot:
+                version, attrs = cPickle.load(snapshot)
+        except (IOError, EOFError, ValueError, TypeError, cPickle.PickleError):
+            return
+        if version == VERSION:
+            self._attrs = attrs
+            self._evict()
+
+    def save(self):
+        """Save the cache."""
+        path = env.flags["snapshot"]
+        if not path:
+            return
+        log.debug("Snapshot.save()", "Attribute cache: %i hits, %i misses" %
+                      (self.hits, self.misses))
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path + ".new", "wb") as snapshot:
+                cPickle.dump((VERSION, self._attrs), snapshot,
+                             cPickle.HIGHEST_PROTOCOL)
+            os.rename(path + ".new", path)
+        except (IOError, OSError), e:
+            log.error("Snapshot.save()",
+                      "Unable to save attribute snapshot: %s" % e)
+
+    def get(self, origin):
+        """Get the attributes of a port, or None if not cached (or stale)."""
+        entry = self._attrs.pop(origin, None)
+        if entry is None or self._fingerprint(*entry[1:3]) != entry[3]:
+            self.misses += 1
+            return None
+        self._attrs[origin] = entry
+        self.hits += 1
+        return entry[0]
+
+    def record(self, origin, attr):
+        """Record the attributes of a port."""
+        # Makefiles may be relative to the port's directory
+        portdir = os.path.join(env.env["PORTSDIR"], origin)
+        files = tuple(os.path.join(portdir, i) for i in attr["makefiles"])
+        optionsfile = attr["optionsfile"]
+        self._attrs.pop(origin, None)
+        self._attrs[origin] = (attr, files, optionsfile,
+                               self._fingerprint(files, optionsfile))
+        self._evict()
+
+    def _evict(self):
+        """Remove the least recently used ports, down to the cache's size."""
+        while len(self._attrs) > self.size:
+            self._attrs.popitem(last=False)
+
+    def _fingerprint(self, files, optionsfile):
+        """Fingerprint the make environment and the contents of the files."""
+        if self._environ is None:
+            self._environ = repr((env.flags["chroot"], sorted(env.env.items()),
+                                  os.environ.get("ARCH"),
+                                  os.environ.get("OSVERSION")))
+        fingerprint = hashlib.md5(self._environ)
+        for path in files:
+            if path not in self._digests:
+                # The Makefiles are not expected to change while running
+                self._digests[path] = self._digest(path)
+            fingerprint.update(path)
+            fingerprint.update(self._digests[path])
+        if optionsfile:
+            # The options file changes when a port is configured
+            fingerprint.update(optionsfile)
+            fingerprint.update(self._digest(optionsfile))
+        return fingerprint.digest()
+
+    @staticmethod
+    def _digest(path):
+        """The digest of a file's contents, or "" if it does not exist."""
+        try:
+            with open(env.flags["chroot"] + path, "rb") as contents:
+                return hashlib.md5(contents.read()).digest()
+        except IOError:
+            return ""
+
+
+db = Snapshot()
@@ -9,7 +9,7 @@ The stacks are (using the env.flags["target"] notation):
  repo    - install a port from a remote repository
 """
 
-from libpb.stacks.base import Stage, Stack
+from libpb.stacks.base import Stage, Stack, StageSet
 from libpb.stacks.common import Config, Depend
 from libpb.stacks.build import Checksum, Fetch, Build, Install, Package
 from libpb.stacks.package import PkgInstall
@@ -17,7 +17,7 @@ from libpb.stacks.repo import RepoConfig, RepoFetch, RepoInstall
 
 __all__ = [
         # The base elements
-        "Stage", "Stack",
+        "Stage", "Stack", "StageSet",
         # "Common" stack"
         "Config", "Depend",
         # "Build" stack
@@ -5,19 +5,63 @@ The stacks.base module.  This module contains the basic Stack and Stage classes.
 import abc
 import time
 
-from libpb import event, job, log
+from libpb import env, event, history, job, log
 
-__all__ = ["Stack", "Stage"]
+__all__ = ["Stack", "Stage", "StageSet"]
 
 
 class Stack(object):
     """The Stack class, each stack is a distinct series of stages."""
+
+    __slots__ = ("failed", "name", "working")
+
     def __init__(self, name):
         self.failed = False
         self.name = name
         self.working = False
 
 
+class StageSet(object):
+    """A set of stages, stored as a bitmask with a bit per stage."""
+
+    __slots__ = ("_mask",)
+
+    _bits = {None: 1}  #: The bit of each stage
+    _stages = [None]   #: The stage of each bit
+
+    def __init__(self, stages=(None,)):
+        """Initialise the set of stages."""
+        self._mask = 0
+        for stage in stages:
+            self.add(stage)
+
+    def __contains__(self, stage):
+        return bool(self._mask & StageSet._bits.get(stage, 0))
+
+    def __iter__(self):
+        for i, stage in enumerate(StageSet._stages):
+            if self._mask & (1 << i):
+                yield stage
+
+    def __len__(self):
+        return bin(self._mask).count("1")
+
+    def __repr__(self):
+        return "StageSet(%r)" % list(self)
+
+    def add(self, stage):
+        """Add a stage to the set."""
+        bit = StageSet._bits.get(stage)
+        if bit is None:
+            bit = StageSet._bits[stage] = 1 << len(StageSet._stages)
+            StageSet._stages.append(stage)
+        self._mask |= bit
+
+    def difference(self, stages):
+        """The stages in this set but not in stages (as a set)."""
+        return set(self).difference(stages)
+
+
 class Stage(job.Job):
     """The Stage class, handles separations of work for a port."""
     __metaclass__ = abc.ABCMeta
@@ -92,6 +136,9 @@ class Stage(job.Job):
         else:
             log.debug("Stage._finalise()", "Port '%s': finished stage %s" %
                           (self.port.origin, self.name))
+            if self.stack.working and not env.flags["no_op"]:
+                history.db.record(self.port.origin, self.name,
+                                  time.time() - self.stack.working)
         self.stack.working = False
         self.port.stages.add(self.__class__)
         self.done()
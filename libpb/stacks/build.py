@@ -6,7 +6,7 @@ The stacks.build module.  This module contains the Stages that make up the
 import contextlib
 import os
 
-from libpb import env, job, log, pkg, queue
+from libpb import env, job, log, pkg, queue, signal
 from libpb.stacks import base, common, mutators
 
 __all__ = ["Checksum", "Fetch", "Build", "Install", "Package"]
@@ -18,6 +18,7 @@ class FileLock(object):
     def __init__(self):
         """Initialise the locks and database of files."""
         self._files = set()
+        self._waiters = {}
 
     def acquire(self, files):
         """Acquire a lock for the given files."""
@@ -31,6 +32,19 @@ class FileLock(object):
         assert self._files.issuperset(files)
 
         self._files.symmetric_difference_update(files)
+        for i in files:
+            if i in self._waiters:
+                self._waiters.pop(i).emit()
+
+    def wait(self, files):
+        """Get a signal emitted when a locked file (of files) is released."""
+        for i in files:
+            if i in self._files:
+                if i not in self._waiters:
+                    self._waiters[i] = signal.Signal("FileLock.wait",
+                                                   oneshot=True)
+                return self._waiters[i]
+        return None
 
     @contextlib.contextmanager
     def lock(self, files):
@@ -80,8 +94,9 @@ class Checksum(Distfiles, mutators.MakeStage):
 
     def _pre_make(self):
         """Issue a make.target() to check the distfiles."""
-        if not Checksum._checksum_lock.acquire(self.port.attr["distfiles"]):
-            raise job.StalledJob()
+        distfiles = self.port.attr["distfiles"]
+        if not Checksum._checksum_lock.acquire(distfiles):
+            raise job.StalledJob(Checksum._checksum_lock.wait(distfiles))
         else:
             self._make_target("checksum", BATCH=True, NO_DEPENDS=True,
                                           DISABLE_CONFLICTS=True, FETCH_REGET=0)
@@ -121,8 +136,9 @@ class Fetch(Distfiles, mutators.MakeStage):
 
     def _pre_make(self):
         """Issue a make.target() command to fetch outstanding distfiles,"""
-        if not Fetch._fetch_lock.acquire(self.port.attr["distfiles"]):
-            raise job.StalledJob()
+        distfiles = self.port.attr["distfiles"]
+        if not Fetch._fetch_lock.acquire(distfiles):
+            raise job.StalledJob(Fetch._fetch_lock.wait(distfiles))
         else:
             self._make_target("checksum", BATCH=True, DISABLE_CONFLICTS=True,
                                           NO_DEPENDS=True)
@@ -145,15 +161,14 @@ class Fetch(Distfiles, mutators.MakeStage):
         # - extend queue to handle non-active "done" jobs
         # - make queue finish via signal, not direct call to queue.done
         # ? track which jobs are handling which distfiles (cleanup with done())
-        # Go through all the pending fetch jobs and see if any have been
-        # resolved due to this job:
-        for q in (queue.fetch.stalled, queue.fetch.queue):
-            for i in range(len(q) - 1, -1, -1):
-                j = q[i]
+        # Go through all the pending fetch jobs (including those waiting on
+        # the lock) and see if any have been resolved due to this job:
+        for q in (queue.fetch.stalled, queue.fetch.queue, queue.fetch.waiting):
+            for j in list(q):
                 if (isinstance(j, Fetch) and
                         not distfiles.isdisjoint(j.port.attr["distfiles"]) and
                         (not j.check(j.port) or j.complete())):
-                    del q[i]
+                    q.remove(j)
                     j.run()
         return status
 
@@ -168,9 +183,18 @@ class Build(mutators.MakeStage, mutators.PostFetch):
     def __init__(self, port):
         super(Build, self).__init__(port, port.attr["jobs_number"])
 
+    def fit(self, load):
+        """Build with fewer make jobs, to fit the available load."""
+        self.load = max(1, load)
+
     def _pre_make(self):
         """Issue a make.target() to build the port."""
-        self._make_target(("all",), BATCH=True, NO_DEPENDS=True)
+        if self.load < self.port.attr["jobs_number"]:
+            # Build load is shared, only use the make jobs granted
+            self._make_target(("all",), BATCH=True, NO_DEPENDS=True,
+                              MAKE_JOBS_NUMBER=self.load)
+        else:
+            self._make_target(("all",), BATCH=True, NO_DEPENDS=True)
 
 
 class Install(mutators.Deinstall, mutators.MakeStage, mutators.PostFetch,
@@ -6,7 +6,7 @@ all other Stacks.
 import contextlib
 import os
 
-from libpb import env, event, job, mk, pkg
+from libpb import env, event, history, job, mk, pkg, signal
 from libpb.stacks import base, mutators
 
 __all__ = ["Config", "Depend"]
@@ -18,6 +18,7 @@ class Lock(object):
     def __init__(self):
         """Initialise lock."""
         self._locked = False
+        self._waiter = None
 
     def acquire(self):
         """Acquire lock."""
@@ -32,6 +33,17 @@ class Lock(object):
         assert self._locked
         self._locked = False
         event.resume()
+        if self._waiter is not None:
+            waiter, self._waiter = self._waiter, None
+            waiter.emit()
+
+    def wait(self):
+        """Get a signal emitted when the lock is released."""
+        if not self._locked:
+            return None
+        if self._waiter is None:
+            self._waiter = signal.Signal("Lock.wait", oneshot=True)
+        return self._waiter
 
     @contextlib.contextmanager
     def lock(self):
@@ -90,7 +102,7 @@ class Config(mutators.MakeStage):
     def _pre_make(self):
         """Issue a make.target() to configure the port."""
         if not Config._config_lock.acquire():
-            raise job.StalledJob()
+            raise job.StalledJob(Config._config_lock.wait())
         self._make_target("config", pipe=False)
 
     def _post_make(self, status):
@@ -98,7 +110,9 @@ class Config(mutators.MakeStage):
         self._config_lock.release()
         if status:
             # TODO: report pid of attr getter
-            mk.Attr(self.port.origin).connect(self._load_attr).get()
+            attr = mk.Attr(self.port.origin).connect(self._load_attr)
+            if not attr.cached():
+                attr.get()
             return None
         return status
 
@@ -106,10 +120,8 @@ class Config(mutators.MakeStage):
         """Load the attributes for this port."""
         self.pid = None
         if attr:
-            self.port.attr = attr
             log_file = self.port.log_file
-            self.port.log_file = os.path.join(env.flags["log_dir"],
-                                              self.port.attr["pkgname"])
+            self.port.attr = mk.PortAttr(attr)
             if log_file != self.port.log_file and os.path.isfile(log_file):
                 os.rename(log_file, self.port.log_file)
         self._finalise(attr is not None)
@@ -124,7 +136,24 @@ class Depend(base.Stage):
 
     def _do_stage(self):
         from libpb.port.dependhandler import Dependency
-        priority = 0
+        from libpb.port.priority import add_weight
+        # Weigh the port by its expected build time, or the size of its
+        # distfiles if there is no history of builds
+        priority = history.db.estimate(self.port.origin)
+        if priority is None:
+            priority = self._distfiles_size()
+        add_weight(self.port, priority)
+        names = ("depend_build", "depend_extract", "depend_fetch",
+                 "depend_lib", "depend_run", "depend_patch", "depend_package")
+        depends = [self.port.attr[i] for i in names]
+        self.port.dependency = Dependency(self.port, depends)
+        # The dependencies are not needed once the Dependency is created
+        self.port.attr.release(*names)
+        self.port.dependency.loaded.connect(self._post_depend)
+
+    def _distfiles_size(self):
+        """The total size of the port's distfiles."""
+        size = 0
         distfiles = self.port.attr["distfiles"]
         distinfo = env.flags["chroot"] + self.port.attr["distinfo"]
         if len(distfiles) and os.path.isfile(distinfo):
@@ -132,18 +161,10 @@ class Depend(base.Stage):
                 for i in file:
                     if i.startswith("SIZE"):
                         i = i.split()
-                        name, size = i[1], i[-1]
-                        name = name[1:-1]
-                        name = name.rsplit('/', 1)[-1]
+                        name = i[1][1:-1].rsplit('/', 1)[-1]
                         if name in distfiles:
-                            priority += int(size)
-        self.port.priority = priority
-        self.port.dependent.priority += priority
-        depends = ("depend_build", "depend_extract", "depend_fetch",
-                   "depend_lib", "depend_run", "depend_patch", "depend_package")
-        depends = [self.port.attr[i] for i in depends]
-        self.port.dependency = Dependency(self.port, depends)
-        self.port.dependency.loaded.connect(self._post_depend)
+                            size += int(i[-1])
+        return size
 
     def _post_depend(self, status):
         """Advance to the build stage if nothing to fetch."""
@@ -37,8 +37,11 @@ class Deinstall(base.Stage):
             self._do_stage()
         else:
             self.port.install_status = pkg.ABSENT
-            self.pid = pkg.remove(self.port).connect(self.__post_pkg_remove).pid
+            pkg_remove = pkg.remove(self.port)
+            pkg_remove.job = self
+            pkg_remove.connect(self.__post_pkg_remove)
             pkg.db.remove(self.port)
+            self.port.dependent.status_changed()
 
     def __post_pkg_remove(self, pkg_remove):
         """Process the results from pkg.remove."""
@@ -100,6 +103,21 @@ class PackageInstaller(base.Stage):
         """Issue a pkg.add() command."""
         pass
 
+    _batch = None  #: The job leading the jobs run together (if any)
+
+    def coalesce(self, jobs):
+        """Install the packages of other ready ports at the same time."""
+        # Ports with a package to deinstall first are installed by themselves
+        if self.port.install_status != pkg.ABSENT:
+            return ()
+        jobs = [i for i in jobs if i.__class__ is self.__class__ and
+                i.port.install_status == pkg.ABSENT][:pkg.BATCH - 1]
+        for job in jobs:
+            job._batch = self  # pylint: disable-msg=W0212
+        if jobs:
+            self._batch = self
+        return jobs
+
     def _do_stage(self):  # pylint: disable-msg=E0202
         """Issue a pkg.add() to install the package from a repo."""
         log.debug("PackageInstaller._do_stage()",
@@ -111,7 +129,9 @@ class PackageInstaller(base.Stage):
         # pkg_add may be False if installing `ports-mgmt/pkg` and
         # env.flags["pkg_mgmt"] == "pkgng"
         if pkg_add:
-            self.pid = pkg_add.connect(self._post_pkg_add).pid
+            pkg_add.batch = self._batch
+            pkg_add.job = self
+            pkg_add.connect(self._post_pkg_add)
         else:
             # Cannot call self._finalise from within self.work() ->
             #   self._do_stage()
@@ -125,9 +145,10 @@ class PackageInstaller(base.Stage):
                      "Port '%s': finished stage %s" %
                         (self.port.origin, self.name))
             if "explicit" not in self.port.flags:
-                pkg_change = self.pid = pkg.change(self.port, "explicit", False)
+                pkg_change = pkg.change(self.port, "explicit", False)
                 if pkg_change:
-                    self.pid = pkg_change.connect(self._post_pkg_change).pid
+                    pkg_change.job = self
+                    pkg_change.connect(self._post_pkg_change)
                     return
             self._finalise(True)
         else:
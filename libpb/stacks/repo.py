@@ -3,9 +3,7 @@ The stacks.repo module.  This module contains the Stage that makes up the "repo"
 stack.
 """
 
-import os
-
-from libpb import env, event, make, pkg
+from libpb import env, event, log, make, pkg
 from libpb.stacks import common, mutators
 
 __all__ = ["RepoConfig", "RepoFetch", "RepoInstall"]
@@ -26,6 +24,12 @@ class RepoConfig(mutators.Repo):
         return not self.port.attr["options"] or env.flags["pkg_mgmt"] == "pkg"
 
     def _do_stage(self):
+        pkgconfig = pkg.repo_db.config(self.port)
+        if pkgconfig is not None:
+            # The package's options were loaded with the repository database
+            event.post_event(self._finalise,
+                             self.port.attr["options"] == pkgconfig)
+            return
         pkg_query = pkg.query(self.port, "config")
         if pkg_query:
             self.pid = pkg_query.connect(self._post_pkg_query).pid
@@ -47,7 +51,7 @@ class RepoConfig(mutators.Repo):
 
 
 class RepoFetch(mutators.Repo):
-    """Fetch the repo package."""
+    """Fetch the repo package into the package cache (ahead of installing)."""
 
     name = "RepoFetch"
     prev = RepoConfig
@@ -55,10 +59,37 @@ class RepoFetch(mutators.Repo):
 
     def complete(self):
         """Check if the package needs to be fetched from the repository."""
-        suffix = pkg.mgmt[env.flags["pkg_mgmt"]].suffix
-        path = os.path.join(env.env["PKG_CACHEDIR"],
-                            self.port.attr["pkgfile"] + suffix)
-        return os.path.isfile(env.flags["chroot"] + path)
+        return pkg.fetched(self.port)
+
+    def coalesce(self, jobs):
+        """Fetch the packages of other ready ports at the same time."""
+        jobs = [i for i in jobs if i.__class__ is self.__class__]
+        return jobs[:pkg.FETCH - 1]
+
+    def _do_stage(self):
+        """Issue a pkg.fetch() to fetch the package."""
+        pkg_fetch = pkg.fetch(self.port)
+        if pkg_fetch:
+            self.pid = pkg_fetch.connect(self._post_pkg_fetch).pid
+        else:
+            # The package is fetched when it is installed
+            event.post_event(self._finalise, True)
+
+    def _post_pkg_fetch(self, pkg_fetch):
+        """Process the results of pkg.fetch()."""
+        self.pid = None
+        if pkg_fetch.wait() != make.SUCCESS:
+            self._finalise(False)
+        elif (env.flags["no_op"] or pkg.repo_db.package(self.port) is None or
+                pkg.fetched(self.port)):
+            # Without the repository database the package's location in the
+            # cache is unknown, and the package manager is trusted
+            self._finalise(True)
+        else:
+            log.error("RepoFetch._post_pkg_fetch()",
+                      "Port '%s': fetched package does not match checksum" %
+                          self.port.origin)
+            self._finalise(False)
 
 
 class RepoInstall(mutators.Deinstall, mutators.PostFetch, mutators.Repo,
@@ -66,7 +97,7 @@ class RepoInstall(mutators.Deinstall, mutators.PostFetch, mutators.Repo,
     """Install a port from a repo package."""
 
     name = "RepoInstall"
-    prev = RepoConfig
+    prev = RepoFetch
     stack = "repo"
 
     def _add_pkg(self):